@@ -1,23 +1,13 @@
 from gui.child_window import ChildWindow
-from utils.dataLoader import DataLoader
 from gui.warning_window import WarningWindow
 from gui.setting_window import SettingWindow
+from gui.live_search import LiveSearch
 from utils.exception import *
+from utils.product import product_type
 import tkinter
 import tkinter.ttk
 import tkinter.filedialog
 
-product_type = {'框架断路器': ['RMW1', 'RMW2', 'ME', 'RMW3'],
-                '塑壳断路器': ['RMM1', 'RMM2', 'RMM3', 'RMM1L', 'RMM2L', 'RMM3L', 'RMM3D'],
-                '小型断路器': ['RMGQ', 'RMC3', 'RMC5', 'RMC3E'],
-                '交流接触器': ['B', 'RMK', 'CJ20', 'CJ40', 'BC', 'RMKC'],
-                '高压真空断路器': ['RMVS1', 'RMV1'],
-                '起动器': ['MSB', 'RMS1', 'RMD2', 'RMS2'],
-                '自动转换开关': ['RMQ1', 'RMQ3', 'RMQ6', 'RMQ5Y', 'RMQ6G'],
-                '其他产品': ['CA', 'CK', 'VB', 'VK', 'T联接板', 'T背包', '单供附件', 'P1700', 'NT'],
-                '热继电器': ['T'],
-                '特种电器': ['RMU1', 'RMG1', 'RMMG1', 'RMU3', 'RMKB1']}
-
 
 class ContractWindow(ChildWindow):
     pass
@@ -249,6 +239,9 @@ class ContractWindow(ChildWindow):
         widget_list["screen_type_cb"] = screen_type_cb
         widget_list["product_search_entry"] = product_search_entry
         widget_list["product_library"] = product_library
+        self.live_search = LiveSearch(product_library, self.data_loader, self.search_query,
+                                      lambda p: (p.get_name(), p.get_model(), p.get_raw_price()))
+        product_search_entry.bind("<KeyRelease>", self.live_search.schedule)
 
         self.products_read()
 
@@ -280,7 +273,7 @@ class ContractWindow(ChildWindow):
         def open_setting(evt):
             setting_menu = SettingWindow(master=self.window, width=1280, height=800, resizable=True, title="设置",
                                          data_loader=self.data_loader, command=setting_recall, minsize_x=1000,
-                                         minsize_y=700)
+                                         minsize_y=700, usage_loaders=[(contract_type, self.contract_loader)])
 
         info_setting_button.bind("<Button-1>", open_setting)
 
@@ -583,45 +576,23 @@ class ContractWindow(ChildWindow):
             self.data["widget_list"]["product_list_delete"].unbind("<Button-1>")
         self.data["delete_lock"] = not self.data["delete_lock"]
 
-    def product_library_set(self, name_list, type_list, price_list, pid_list):
-        self.data["pid_list"] = pid_list
-        # product_id_list = list()
-        for i in range(len(name_list)):
-            id_tag = str(pid_list[i])
-            # product_id_list.append(id_tag)
-            self.data["widget_list"]["product_library"].insert('', i,
-                                                               values=(name_list[i], type_list[i], price_list[i]),
-                                                               tags=(id_tag, "all"), iid=id_tag)
-        # self.data["product_id_list"] = product_id_list
-
     def product_load(self, product_list):
-        for i in self.data["widget_list"]["product_library"].get_children():
-            self.data["widget_list"]["product_library"].delete(i)
-        name_list = list()
-        type_list = list()
-        price_list = list()
-        pid_list = list()
-        for i in product_list:
-            pid_list.append(i[0])
-            product = i[1]
-            name_list.append(product.get_name())
-            type_list.append(product.get_model())
-            price_list.append(product.get_raw_price())
-        self.product_library_set(name_list, type_list, price_list, pid_list)
+        self.live_search.load(product_list)
 
     def products_read(self):
         data_loader = self.data_loader
         self.product_load(data_loader.get_products_list())
 
-    def search(self):
+    def search_query(self):
         name = self.data["widget_list"]["screen_name_cb"].get()
         type = self.data["widget_list"]["screen_type_cb"].get()
         name = None if name == "全部" else name
         type = None if type == "全部" else type
         keyword = self.data["widget_list"]["product_search_entry"].get("1.0", 'end-1c')
-        data_loader = self.data_loader
-        product_list = DataLoader.search(data_loader.get_products_list(), name, type, keyword)
-        self.product_load(product_list)
+        return name, type, keyword
+
+    def search(self):
+        self.live_search.search()
 
     def screen_name_change(self, evt):
         choice = self.data["widget_list"]["screen_name_cb"].get()
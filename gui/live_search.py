@@ -0,0 +1,101 @@
+from utils.searchIndex import matches
+
+
+class LiveSearch:
+    """
+    Search-as-you-type for a product Treeview whose row iids are pids.
+    Keystrokes are debounced, a keyword extending the previous one only filters the previous result, and when
+    nothing matches the closest models by edit distance are shown instead. The Treeview is updated by deleting
+    and inserting the rows that differ. Rows are inserted in chunks between events, so a newer search cancels
+    whatever an older one did not insert yet.
+    """
+    delay = 200  # ms of typing pause before searching
+    chunk = 300  # rows inserted per turn of the event loop
+
+    def __init__(self, tree, data_loader, get_query, get_values):
+        """
+        :param tree: ttk.Treeview
+        :param data_loader: DataLoader or SqlDataLoader
+        :param get_query: () -> (name, model, keyword)
+        :param get_values: Product -> values of its row
+        """
+        self.tree = tree
+        self.data_loader = data_loader
+        self.get_query = get_query
+        self.get_values = get_values
+        self._query = None  # query of _result, None if the shown list is not a search result
+        self._result = []
+        self._revision = None  # catalog revision of _result
+        self._rows = []  # [(index, iid, product)] not inserted yet, last one first
+        self._search_job = None
+        self._insert_job = None
+
+    def schedule(self, evt=None):
+        """Search once typing pauses, bound to <KeyRelease> of the search entry."""
+        if self._search_job is not None:
+            self.tree.after_cancel(self._search_job)
+        self._search_job = self.tree.after(self.delay, self._run)
+
+    def _run(self):
+        self._search_job = None
+        if self.tree.winfo_exists():
+            self.search(narrow=True)
+
+    def search(self, narrow=False):
+        """
+        :param narrow: filter the previous result when possible (the catalog did not change since)
+        """
+        if self._search_job is not None:
+            self.tree.after_cancel(self._search_job)
+            self._search_job = None
+        query = self.get_query()
+        previous = self._query
+        if narrow and query == previous:
+            return
+        if narrow and previous is not None and query[:2] == previous[:2] and previous[2] and \
+                previous[2] in query[2] and self._revision == self.data_loader.revision:
+            result = [p for p in self._result if matches(p[1], query[2])]
+        else:
+            result = self.data_loader.search_products(*query)
+        if result or not query[2]:
+            self.load(result)
+        else:
+            self.load(self.data_loader.fuzzy_search(query[2], name=query[0]))
+        self._query = query
+        self._result = result
+        self._revision = self.data_loader.revision
+
+    def load(self, product_list):
+        """
+        Show product_list, rows already shown in the same order are kept.
+        :param product_list: [(pid, Product)]
+        """
+        self._query = None
+        if self._insert_job is not None:
+            self.tree.after_cancel(self._insert_job)
+            self._insert_job = None
+        rows = [(str(pid), product) for pid, product in product_list]
+        wanted = {iid for iid, _ in rows}
+        children = self.tree.get_children()
+        gone = [iid for iid in children if iid not in wanted]
+        if gone:
+            self.tree.delete(*gone)
+        kept = [iid for iid in children if iid in wanted]
+        kept_set = set(kept)
+        if kept != [iid for iid, _ in rows if iid in kept_set]:
+            if kept:
+                self.tree.delete(*kept)
+            kept_set = set()
+        self._rows = [(index, iid, product) for index, (iid, product) in enumerate(rows) if iid not in kept_set]
+        self._rows.reverse()
+        self._insert()
+
+    def _insert(self):
+        self._insert_job = None
+        if not self.tree.winfo_exists():
+            return
+        for _ in range(min(self.chunk, len(self._rows))):
+            index, iid, product = self._rows.pop()
+            self.tree.insert('', index, values=self.get_values(product), tags=(iid, "all"), iid=iid)
+        if self._rows:
+            self._insert_job = self.tree.after(1, self._insert)
@@ -67,6 +67,7 @@ class MainWindow(Window):
         self.info_list = dict()
         self.now_size = [1260, 900]
         self.detail_data = dict()
+        self.save_warning = False
         self.data_loader = data_loader
         self.contract_loader = contract_loader
         self.quote_loader = quote_loader
@@ -444,10 +445,11 @@ class MainWindow(Window):
         self.info_list["refresh_button"] = refresh_button
 
         def refresh_file(evt):
-            self.contract_loader.refresh()
+            contract_changes = self.contract_loader.refresh()
             self.data_loader.refresh()
-            self.quote_loader.refresh()
-            self.refresh_agm()
+            quote_changes = self.quote_loader.refresh()
+            if self.view_affected(contract_changes, quote_changes):
+                self.refresh_agm()
 
         refresh_button.bind("<Button-1>", refresh_file)
 
@@ -462,6 +464,7 @@ class MainWindow(Window):
 
         self.get_menu_click(0)(None)
         self.info_frame.update()
+        self.check_save_status()
 
         def create_click(evt):
             self.new_built()
@@ -669,8 +672,22 @@ class MainWindow(Window):
                 folder = self.file_list[file_id]["agm_code"]
                 self.open_folder(folder)
 
+            def archive_folder():
+                year = self.file_list[file_id]["agm_code"]
+                loader = self.contract_loader if self.folder_type == "contract" else self.quote_loader
+
+                def archive_sure():
+                    loader.archive_year(year)
+                    self.refresh_agm()
+
+                warning_window = WarningWindow(master=self.window, text=f"确定要归档{year}年的文件吗？",
+                                               command=archive_sure)
+
             self.item_menu.delete(0, 10)
             self.item_menu.add_command(label="打开文件夹", command=open_folder)
+            path = self.contract_path if self.folder_type == "contract" else self.quote_path
+            if not path and int(self.file_list[file_id]["agm_code"]) < int(self.contract_loader.get_today()[0]):
+                self.item_menu.add_command(label="归档该年度", command=archive_folder)
             self.item_menu.post(pos[0], pos[1])
         elif file_type == "add_contract":
             def add_con():
@@ -725,7 +742,8 @@ class MainWindow(Window):
 
     def open_setting_menu(self, evt):
         setting_menu = SettingWindow(master=self.window, width=1280, height=800, resizable=True, title="设置",
-                                     data_loader=self.data_loader, minsize_x=1000, minsize_y=700)
+                                     data_loader=self.data_loader, minsize_x=1000, minsize_y=700,
+                                     usage_loaders=[("合同", self.contract_loader), ("报价单", self.quote_loader)])
 
     def open_contract(self, cid):
         if len(cid) == 10:
@@ -1233,6 +1251,64 @@ class MainWindow(Window):
         self.file_list = list()
         self.tem_canvas.delete("all")
 
+    def check_save_status(self):
+        pending = 0
+        failed = list()
+        for loader in (self.contract_loader, self.quote_loader):
+            status = loader.get_save_status()
+            pending += status[0]
+            failed += status[1]
+        title = "森源电气有限公司-合同管理V1.2.0"
+        self.window.title(title + " (正在保存…)" if pending else title)
+        if failed and not self.save_warning:
+            self.save_warning = True
+
+            def retry():
+                self.save_warning = False
+                self.contract_loader.retry_failed_saves()
+                self.quote_loader.retry_failed_saves()
+
+            WarningWindow(self.window, "文件保存失败，请检查共享文件夹，\n点击确定重试。", command=retry)
+        self.window.after(1000, self.check_save_status)
+
+    def view_affected(self, contract_changes, quote_changes):
+        """
+        :param contract_changes: report of ContractLoader.refresh
+        :param quote_changes: report of QuoteLoader.refresh
+        :return: True if the folder on screen or the chosen file has to be redrawn
+        """
+        value = None
+        for i in self.menu_list:
+            if self.menu_canvas.itemcget(i["select_sign"], "fill") == "#649AFA":
+                value = i["value"]
+                break
+        if value == "合同模板":
+            changes = contract_changes
+            folder = None
+        elif value == "合同":
+            changes = contract_changes
+            folder = self.contract_path
+        elif value == "报价单":
+            changes = quote_changes
+            folder = self.quote_path
+        else:
+            return True
+        for kind in ("added", "changed", "removed"):
+            for cid in changes[kind]:
+                if cid == self.chosen_contract:
+                    return True
+                if folder is None:
+                    if cid.startswith("0000"):
+                        return True
+                elif cid.startswith("0000"):
+                    continue
+                elif len(folder) == 0:
+                    if kind != "changed":
+                        return True
+                elif cid[:2] == folder[0][-2:] and (len(folder) == 1 or cid[2:4] == "{:0>2d}".format(int(folder[1]))):
+                    return True
+        return False
+
     def refresh_agm(self):
         for i in self.menu_list:
             if self.menu_canvas.itemcget(i["select_sign"], "fill") == "#649AFA":
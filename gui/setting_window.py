@@ -5,22 +5,12 @@ import re
 from gui.child_window import ChildWindow
 from gui.warning_window import WarningWindow
 from gui.assembly import StandardBar
-from utils.dataLoader import DataLoader
+from gui.live_search import LiveSearch
+from gui.usage_window import UsageWindow
 from utils.exception import *
-from utils.product import Product
+from utils.product import Product, product_type
 from pathlib import Path
 
-product_type = {'框架断路器': ['RMW1', 'RMW2', 'ME', 'RMW3'],
-                '塑壳断路器': ['RMM1', 'RMM2', 'RMM3', 'RMM1L', 'RMM2L', 'RMM3L', 'RMM3D'],
-                '小型断路器': ['RMGQ', 'RMC3', 'RMC5', 'RMC3E'],
-                '交流接触器': ['B', 'RMK', 'CJ20', 'CJ40', 'BC', 'RMKC'],
-                '高压真空断路器': ['RMVS1', 'RMV1'],
-                '起动器': ['MSB', 'RMS1', 'RMD2', 'RMS2'],
-                '自动转换开关': ['RMQ1', 'RMQ3', 'RMQ6', 'RMQ5Y', 'RMQ6G'],
-                '其他产品': ['CA', 'CK', 'VB', 'VK', 'T联接板', 'T背包', '单供附件', 'P1700', 'NT'],
-                '热继电器': ['T'],
-                '特种电器': ['RMU1', 'RMG1', 'RMMG1', 'RMU3', 'RMKB1']}
-
 
 class SettingWindow(ChildWindow):
     setting_count = 0
@@ -105,6 +95,9 @@ class SettingWindow(ChildWindow):
         if 'clear_contract_entry' not in __class__.settings:
             cls.settings["clear_contract_entry"] = '1-1-1'
 
+        if 'data_backend' not in __class__.settings:
+            cls.settings["data_backend"] = 'pickle'  # pickle or sqlite
+
     def gui_init(self, window):
         self.load_setting()
         logging_level = tkinter.IntVar()
@@ -533,6 +526,22 @@ class SettingWindow(ChildWindow):
 
         product_list_box.bind('<<TreeviewSelect>>', select)
         self.data["product_treeview"] = product_list_box
+
+        product_menu = tkinter.Menu(product_list_box, tearoff=False, font="新宋体 13", bg="#262626", fg="#A0A0A0")
+
+        def product_menu_show(evt):
+            iid = product_list_box.identify_row(evt.y)
+            if not iid or not self.data.get("usage_loaders"):
+                return
+            product_list_box.selection_set(iid)
+            product_menu.delete(0, "end")
+            product_menu.add_command(label="查看使用情况", command=lambda: self.show_usage(int(iid)))
+            product_menu.post(evt.x_root, evt.y_root)
+
+        product_list_box.bind("<Button-3>", product_menu_show)
+        self.live_search = LiveSearch(product_list_box, self.data["data_loader"], self.search_query,
+                                      lambda p: (p.get_name(), p.get_model(), p.get_adjunct(), p.get_raw_price(),
+                                                 p.get_adjunct_price()))
         self.data["product_id_list"] = list()
         self.products_read()
         # self.product_list_set(test_name, test_type, test_adjunct, test_price, test_adjunctPrice)
@@ -605,6 +614,7 @@ class SettingWindow(ChildWindow):
         product_search_button.bind("<Button-1>", to_search)
         product_search_entry.unbind("<Return>")
         product_search_entry.bind("<Return>", to_search)
+        product_search_entry.bind("<KeyRelease>", self.live_search.schedule)
         screen_type_cb.bind("<<ComboboxSelected>>", to_search)
 
         def tab_select(evt):
@@ -634,17 +644,6 @@ class SettingWindow(ChildWindow):
             if type(widget_list[i]) == tkinter.Text and i != "product_search_entry":
                 widget_list[i].bind("<Key>", tab_select)
 
-    def product_list_set(self, name_list, type_list, adjunct_list, price_list, adjunctPrice_list, pid_list):
-        self.data["pid_list"] = pid_list
-        # product_id_list = list()
-        for i in range(len(name_list)):
-            id_tag = str(pid_list[i])
-            # product_id_list.append(id_tag)
-            self.data["product_treeview"].insert('', i,
-                                                 values=(name_list[i], type_list[i], adjunct_list[i], price_list[i],
-                                                         adjunctPrice_list[i]), tags=(id_tag, "all"), iid=id_tag)
-        # self.data["product_id_list"] = product_id_list
-
     def lock_change(self, evt):
         if self.data["delete_lock"]:
             self.data["widget_list"]["product_delete_lock"].configure(image=self.data["unlock_image"])
@@ -680,6 +679,10 @@ class SettingWindow(ChildWindow):
         self.data["widget_list"]["screen_type_cb"].current(0)
         self.data["widget_list"]["product_search_entry"].delete("1.0", "end")
 
+    def show_usage(self, pid):
+        """Contracts and quotes using the product, usage_loaders: [(type shown, ContractLoader or QuoteLoader)]"""
+        UsageWindow(self.window, self.data["data_loader"].get_product(pid), self.data["usage_loaders"])
+
     def delete_product(self, evt):
         selection = self.data["product_treeview"].selection()
         data_loader = self.data["data_loader"]
@@ -717,23 +720,7 @@ class SettingWindow(ChildWindow):
         self.clear()
 
     def product_load(self, product_list):
-        for i in self.data["product_treeview"].get_children():
-            self.data["product_treeview"].delete(i)
-        name_list = list()
-        type_list = list()
-        price_list = list()
-        adjunct_list = list()
-        adjunctPrice_list = list()
-        pid_list = list()
-        for i in product_list:
-            pid_list.append(i[0])
-            product = i[1]
-            name_list.append(product.get_name())
-            type_list.append(product.get_model())
-            price_list.append(product.get_raw_price())
-            adjunct_list.append(product.get_adjunct())
-            adjunctPrice_list.append(product.get_adjunct_price())
-        self.product_list_set(name_list, type_list, adjunct_list, price_list, adjunctPrice_list, pid_list)
+        self.live_search.load(product_list)
 
     def products_read(self):
         data_loader = self.data["data_loader"]
@@ -789,15 +776,16 @@ class SettingWindow(ChildWindow):
             form_list.append(" %s %s %s %s %s" % (form_name, form_type, form_adjunct, form_price, form_adjunctPrice))
         return form_list
 
-    def search(self):
+    def search_query(self):
         name = self.data["widget_list"]["screen_name_cb"].get()
         type = self.data["widget_list"]["screen_type_cb"].get()
         name = None if name == "全部" else name
         type = None if type == "全部" else type
         keyword = self.data["widget_list"]["product_search_entry"].get("1.0", 'end-1c')
-        data_loader = self.data["data_loader"]
-        product_list = DataLoader.search(data_loader.get_products_list(), name, type, keyword)
-        self.product_load(product_list)
+        return name, type, keyword
+
+    def search(self):
+        self.live_search.search()
 
     def screen_name_change(self, evt):
         choice = self.data["widget_list"]["screen_name_cb"].get()
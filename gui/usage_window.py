@@ -0,0 +1,45 @@
+import tkinter
+import tkinter.ttk
+from gui.child_window import ChildWindow
+
+
+class UsageWindow(ChildWindow):
+    """Contracts and quotes whose table contains a product."""
+
+    def __init__(self, master, product, loaders, width=700, height=450, minsize_x=500, minsize_y=300,
+                 title="使用情况", resizable=True):
+        """
+        :param product: Product
+        :param loaders: [(type shown, ContractLoader or QuoteLoader)]
+        """
+        self.product = product
+        self.loaders = loaders
+        super().__init__(master, width, height, minsize_x, minsize_y, resizable, title)
+
+    def gui_init(self, window):
+        title_label = tkinter.Label(window, bg="#323232", fg="#A0A0A0", anchor="w", padx=10, pady=10,
+                                    text=f"{self.product.get_name()} {self.product.get_specs()}")
+        columns = ("type", "number", "name", "lines")
+        usage_tree = tkinter.ttk.Treeview(window, show="headings", columns=columns, style="Custom.Treeview")
+        usage_tree.heading("type", text="类型")
+        usage_tree.heading("number", text="编号")
+        usage_tree.heading("name", text="名称")
+        usage_tree.heading("lines", text="行号")
+        usage_tree.column("type", width=80, anchor="w")
+        usage_tree.column("number", width=120, anchor="w")
+        usage_tree.column("name", width=300, anchor="w")
+        usage_tree.column("lines", width=150, anchor="w")
+        count = 0
+        for type_name, loader in self.loaders:
+            for key, name, lines in loader.where_used(self.product):
+                usage_tree.insert('', 'end', values=(type_name, key, name, ','.join(str(i) for i in lines)))
+                count += 1
+        count_label = tkinter.Label(window, bg="#323232", fg="#A0A0A0", anchor="w", padx=10, pady=5,
+                                    text=f"共 {count} 个文件使用该产品" if count else "没有文件使用该产品")
+        usage_scroll = tkinter.Scrollbar(window, command=usage_tree.yview)
+        usage_tree.configure(yscrollcommand=usage_scroll.set)
+
+        title_label.pack(side="top", fill="x")
+        count_label.pack(side="bottom", fill="x")
+        usage_scroll.pack(side="right", fill="y")
+        usage_tree.pack(side="top", fill="both", expand=1)
@@ -1,6 +1,7 @@
 from gui.main_window import MainWindow
 from gui.setting_window import SettingWindow
 from utils.dataLoader import DataLoader
+from utils.sqlDataLoader import SqlDataLoader
 from utils.contractLoader import ContractLoader
 from utils.quoteLoader import QuoteLoader
 import logging
@@ -15,7 +16,12 @@ logging.basicConfig(filename='logger.log',
                     format='%(asctime)s,%(msecs)d %(name)s %(levelname)s %(message)s',
                     datefmt='%H:%M:%S',
                     level=logging_level)
-dl = DataLoader.load()
+if settings['data_backend'] == 'sqlite':
+    dl = SqlDataLoader.load()
+else:
+    dl = DataLoader.load()
 cl = ContractLoader()
 ql = QuoteLoader()
 main_window = MainWindow(dl, cl, ql)
+cl.close()
+ql.close()
@@ -0,0 +1,112 @@
+import itertools
+import random
+
+from utils import money
+from utils.contract import numToBig
+
+
+def baseline_num_to_big(num):
+    """utils.contract.numToBig before it was rewritten on top of money.to_daxie, kept verbatim as the reference."""
+    dict1 = {1: '壹', 2: '贰', 3: '叁', 4: '肆', 5: '伍', 6: '陆', 7: '柒', 8: '捌', 9: '玖', 0: '零'}
+    dict2 = {2: '拾', 3: '佰', 4: '仟', 5: '万', 6: '拾', 7: '佰', 8: '仟', 1: '元', 9: '角', 10: '分', 11: '整'}
+    money = ''  # 最终大写数字
+    flag = False  # 去掉多余的十百千
+    flag2 = False  # 增加零
+    ifint = False  # 整
+    count = 0
+    count2 = 8
+    if int(num) == num:
+        num = int(num)
+    strnum = str(num)
+
+    aa = strnum.split('.')
+    bb = list(str(aa[:1])[2:-2])
+    cc = list(str(aa[1:])[2:-2])
+    # 此处控制：无小数时输出xxx元整
+    # 若要求一位小数也带整，即xxx元整并且xxx元xx角整，则修改下方0为1
+    if len(cc) <= 0:
+        ifint = True
+    else:
+        ifint = False
+    # 整数部分
+    for i in reversed(bb):
+        count = count + 1
+        if (int(i) == 0):
+            if (flag == True):
+                if (count != 5):
+                    continue
+                else:
+                    money = dict2[count] + money
+            else:
+                if (flag2 == False):
+                    money = dict2[count] + money
+                else:
+                    if (count != 5):
+                        money = '零' + money
+                    else:
+                        money = dict2[count] + '零' + money
+            flag = True
+        else:
+            flag = False
+            flag2 = True
+            money = dict1[int(i)] + dict2[count] + money
+    # 小数部分
+    for i in cc:
+        count2 = count2 + 1
+        money = money + dict1[int(i)] + dict2[count2]
+    if (ifint == True):
+        money = money + '整'
+    return money
+
+
+# The baseline supports amounts below 10^8 yuan (its place names stop at 仟万).
+LIMIT = 10 ** 10
+
+
+def expected(fen):
+    """Baseline output with the two deliberate differences applied."""
+    if fen == 0:
+        return '零元整'  # was 元整
+    old = baseline_num_to_big(fen / 100)
+    if fen < 100:
+        # Below one yuan nothing is written for the yuan: 元叁角 -> 叁角, 元零角伍分 -> 伍分
+        old = old[len('元'):]
+        return old[len('零角'):] if old.startswith('零角') else old
+    return old.replace('零角', '零')  # 壹元零角伍分 -> 壹元零伍分
+
+
+def check(fen):
+    assert money.to_daxie(fen) == expected(fen), fen
+
+
+def test_every_amount_below_ten_thousand_yuan():
+    for fen in range(10 ** 6):
+        check(fen)
+
+
+def test_every_zero_pattern_and_digit():
+    # Placement of 零 and of the section units only depends on which of the 10 places (8 yuan digits, jiao, fen)
+    # are zero; every pattern is checked with every digit value in every non-zero place.
+    for pattern in itertools.product((False, True), repeat=10):
+        for digit in range(1, 10):
+            places = [(digit + i) % 9 + 1 if nonzero else 0 for i, nonzero in enumerate(pattern)]
+            check(int(''.join(map(str, places))))
+
+
+def test_random_amounts():
+    rng = random.Random(0)
+    for _ in range(200000):
+        check(rng.randrange(LIMIT))
+
+
+def test_beyond_the_baseline_range():
+    assert money.to_daxie(12345678901234) == '壹仟贰佰叁拾肆亿伍仟陆佰柒拾捌万玖仟零壹拾贰元叁角肆分'
+    assert money.to_daxie(10 ** 10) == '壹亿元整'
+    assert money.to_daxie(100000000005) == '壹拾亿元零伍分'
+    assert money.to_daxie(1000000010000) == '壹佰亿零壹佰元整'
+    assert money.to_daxie(-30) == '负叁角'
+
+
+def test_num_to_big_and_batch():
+    assert numToBig(1351.98) == '壹仟叁佰伍拾壹元玖角捌分'
+    assert money.to_daxie_list([100, 30, 100]) == ['壹元整', '叁角', '壹元整']
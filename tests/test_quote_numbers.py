@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip('xlsxwriter')  # utils.quoteLoader imports utils.excel
+
+from utils.quote import Quote, qid_number
+from utils.quoteLoader import QuoteLoader
+
+FIELDS = dict(project_name='项目', date=('2024', '5', '1'), buyer_name='买方', buyer_contact='', buyer_tel='',
+              quote_contact='', quote_tel='', qq='', name='报价', comment='')
+
+
+def test_loader_allocates_on_empty_tree(tmp_path):
+    data_dir = tmp_path / 'data'  # first start: the data directory does not exist yet
+    loader = QuoteLoader(data_dir)
+    qids = [loader.create_quote(**FIELDS)[1] for _ in range(3)]
+    loader.close()
+    assert len(set(qids)) == 3
+    loader = QuoteLoader(data_dir)
+    assert all(loader.numbers.is_used(*qid_number(qid)) for qid in qids)
+    loader.close()
+
+
+def test_save_allocates_on_empty_tree(tmp_path):
+    first, second = Quote(**FIELDS), Quote(**FIELDS)
+    first.save(tmp_path / 'data')
+    second.save(tmp_path / 'data')
+    assert first.qid and second.qid and first.qid != second.qid
+    assert (tmp_path / 'data' / 'quote' / f'{second.qid}.data').exists()
+
+
+def test_failed_save_releases_the_number(tmp_path, monkeypatch):
+    loader = QuoteLoader(tmp_path / 'data')
+    qids = []
+
+    def fail(self, *args, **kwargs):
+        qids.append(self.qid)
+        raise OSError('disk full')
+
+    monkeypatch.setattr(Quote, 'save', fail)
+    with pytest.raises(OSError):
+        loader.create_quote(**FIELDS)
+    assert not loader.numbers.is_used(*qid_number(qids[0]))
+    loader.close()
@@ -0,0 +1,227 @@
+from utils import money
+from utils.product import series_of
+import numpy as np
+import pickle
+
+# Columns of the line table and their types, the first five are codes usable as group keys
+_COLUMNS = (('contract', np.int32), ('month', np.int32), ('buyer', np.int32), ('series', np.int32),
+            ('product', np.int32), ('quantity', np.int64), ('discount', np.float64), ('amount_fen', np.int64))
+_LABELED = ('contract', 'buyer', 'series', 'product')
+_VALUES = {'amount': 'amount_fen', 'quantity': 'quantity', 'discount': 'discount'}
+
+
+def _stamp(header):
+    """Header fields a contract's lines are extracted from, the lines are extracted again when they change."""
+    return header['total_fen'], header['quantity'], header['buyer'], header['products']
+
+
+def _month(cid):
+    """Month of a cid counted from 2000-01, 'yymm...' -> (yy * 12 + mm - 1)"""
+    return int(cid[:2]) * 12 + int(cid[2:4]) - 1
+
+
+class _Codes:
+    """Dictionary encoding of a string column: value <-> small int code."""
+
+    def __init__(self, values=()):
+        self.values = list(values)
+        self.codes = {value: code for code, value in enumerate(self.values)}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class SalesAnalytics:
+    """
+    Every table line of every contract as one row of a columnar NumPy table: contract, month, buyer, product
+    series, product, quantity, discount and amount in fen. Strings are dictionary encoded, so a group-by is a
+    np.bincount over an int column and takes milliseconds for hundreds of thousands of lines.
+    Rows of a contract are contiguous. When a contract is saved again its old rows are masked out and the new
+    ones appended, the arrays are compacted once half of them are dead.
+    """
+    version = 2
+
+    def __init__(self, load_table):
+        """
+        :param load_table: cid -> table of the contract, [(product, quantity, discount, comment)]
+        """
+        self.load_table = load_table
+        self.columns = {name: np.zeros(0, dtype) for name, dtype in _COLUMNS}
+        self.alive = np.zeros(0, bool)
+        self.size = 0  # rows in use, the arrays are longer to leave room for appending
+        self.dead = 0  # rows masked out
+        self.rows = {}  # {cid: (first row, end row)}
+        self.stamps = {}  # {cid: _stamp(header) when its rows were extracted}
+        self.labels = {name: _Codes() for name in _LABELED}
+        self.changed = False
+
+    def _reserve(self, count):
+        capacity = len(self.alive)
+        if self.size + count <= capacity:
+            return
+        capacity = max(self.size + count, capacity * 2, 1024)
+        for name, array in self.columns.items():
+            self.columns[name] = np.resize(array[:self.size], capacity)
+        self.alive = np.resize(self.alive[:self.size], capacity)
+        self.alive[self.size:] = False
+
+    def _compact(self):
+        alive = self.alive[:self.size]
+        for name, array in self.columns.items():
+            self.columns[name] = array[:self.size][alive]
+        index = np.cumsum(alive) - 1  # new position of every alive row
+        self.rows = {cid: (int(index[start]), int(index[start]) + end - start)
+                     for cid, (start, end) in self.rows.items()}
+        self.size = len(self.columns['contract'])
+        self.alive = np.ones(self.size, bool)
+        self.dead = 0
+
+    def remove(self, cid):
+        rows = self.rows.pop(cid, None)
+        self.stamps.pop(cid, None)
+        if rows is None:
+            return
+        start, end = rows
+        self.alive[start:end] = False
+        self.dead += end - start
+        self.changed = True
+        if self.dead > self.size // 2:
+            self._compact()
+
+    def set(self, cid, header, table=None):
+        """
+        Extract the lines of contract cid (again) if its header changed since, header None removes it.
+        :param table: table of the contract if it is at hand, loaded with load_table otherwise
+        """
+        if header is None:
+            self.remove(cid)
+            return
+        stamp = _stamp(header)
+        if self.stamps.get(cid) == stamp:
+            return
+        if table is None:
+            table = self.load_table(cid)
+        self.remove(cid)
+        self.stamps[cid] = stamp
+        self.changed = True
+        if not table:
+            return
+        count = len(table)
+        self._reserve(count)
+        start, end = self.size, self.size + count
+        codes = self.labels
+        columns = self.columns
+        columns['contract'][start:end] = codes['contract'].code(cid)
+        columns['month'][start:end] = _month(cid)
+        columns['buyer'][start:end] = codes['buyer'].code(header['buyer'])
+        columns['series'][start:end] = [codes['series'].code(series_of(line[0].model)) for line in table]
+        columns['product'][start:end] = [codes['product'].code(line[0].model) for line in table]
+        columns['quantity'][start:end] = [line[1] for line in table]
+        columns['discount'][start:end] = [line[2] for line in table]
+        columns['amount_fen'][start:end] = [money.line_total(*line[:3]) for line in table]
+        self.alive[start:end] = True
+        self.rows[cid] = (start, end)
+        self.size = end
+
+    def sync(self, headers):
+        """
+        Bring the table up to date with the contracts, only contracts added or changed since it was persisted
+        are loaded.
+        :param headers: {cid: header}
+        """
+        for cid in [cid for cid in self.stamps if cid not in headers]:
+            self.remove(cid)
+        for cid, header in headers.items():
+            self.set(cid, header)
+
+    def _mask(self, year=None, month=None):
+        mask = self.alive[:self.size]
+        if year:
+            months = self.columns['month'][:self.size]
+            first = (int(str(year)[-2:]) * 12) + (int(month) - 1 if month else 0)
+            mask = mask & (months >= first) & (months < first + (1 if month else 12))
+        return mask
+
+    def _group(self, by, year, month):
+        """:return: mask of the selected rows, their group codes, number of groups"""
+        if by not in _LABELED and by != 'month':
+            raise ValueError(f'Can not group by {by}')
+        mask = self._mask(year, month)
+        codes = self.columns[by][:self.size][mask]
+        return mask, codes, (len(self.labels[by].values) if by in _LABELED else int(codes.max(initial=-1)) + 1)
+
+    def _label(self, by, code):
+        if by == 'month':
+            return f'20{code // 12:0>2d}-{code % 12 + 1:0>2d}'
+        return self.labels[by].values[code]
+
+    def count(self, by, year=None, month=None):
+        """:return: {group: number of lines}"""
+        _, codes, groups = self._group(by, year, month)
+        counts = np.bincount(codes, minlength=groups)
+        return {self._label(by, code): int(counts[code]) for code in np.flatnonzero(counts)}
+
+    def sum(self, by, value='amount', year=None, month=None):
+        """
+        Sum of a value per group, e.g. sum('series') is the revenue of every product series.
+        :param by: 'series', 'product', 'buyer', 'month' ('yyyy-mm') or 'contract'
+        :param value: 'amount' (in yuan), 'quantity' or 'discount'
+        :param year: e.g. '2021', None for all years
+        :param month: e.g. '8', None for the whole year
+        :return: {group: sum}, groups without lines in the period are left out
+        """
+        mask, codes, groups = self._group(by, year, month)
+        values = self.columns[_VALUES[value]][:self.size][mask]
+        counts = np.bincount(codes, minlength=groups)
+        sums = np.zeros(groups, values.dtype)  # integer columns stay exact, bincount weights go through float64
+        np.add.at(sums, codes, values)
+        if value == 'amount':
+            return {self._label(by, code): money.to_yuan(int(sums[code])) for code in np.flatnonzero(counts)}
+        return {self._label(by, code): sums[code].item() for code in np.flatnonzero(counts)}
+
+    def mean(self, by, value='discount', year=None, month=None, weight=None):
+        """
+        Mean of a value per group, e.g. mean('series') is the average discount of every product series.
+        :param weight: None for the plain mean of the lines, 'quantity' or 'amount' to weight every line
+        :return: {group: mean}
+        """
+        mask, codes, groups = self._group(by, year, month)
+        values = self.columns[_VALUES[value]][:self.size][mask].astype(np.float64)
+        if weight is None:
+            weights = np.ones(len(values))
+        else:
+            weights = self.columns[_VALUES[weight]][:self.size][mask].astype(np.float64)
+        sums = np.bincount(codes, weights=values * weights, minlength=groups)
+        totals = np.bincount(codes, weights=weights, minlength=groups)
+        return {self._label(by, code): float(sums[code] / totals[code]) for code in np.flatnonzero(totals)}
+
+    def dumps(self):
+        if self.dead:
+            self._compact()
+        self.changed = False
+        columns = {name: array[:self.size] for name, array in self.columns.items()}
+        labels = {name: codes.values for name, codes in self.labels.items()}
+        return pickle.dumps((self.version, columns, self.rows, self.stamps, labels), protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path, load_table):
+        """
+        :return: SalesAnalytics persisted at path, an empty one if there is none or it is outdated or broken
+        """
+        analytics = SalesAnalytics(load_table)
+        try:
+            with open(path, 'rb') as f:
+                version, columns, rows, stamps, labels = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return analytics
+        if version == SalesAnalytics.version:
+            analytics.columns = columns
+            analytics.size = len(columns['contract'])
+            analytics.alive = np.ones(analytics.size, bool)
+            analytics.rows, analytics.stamps = rows, stamps
+            analytics.labels = {name: _Codes(values) for name, values in labels.items()}
+        return analytics
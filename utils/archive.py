@@ -0,0 +1,152 @@
+from pathlib import Path
+import logging
+import pickle
+import struct
+import zlib
+import os
+
+MAGIC = b'AGPK'
+_FOOTER = struct.Struct('<Q4s')  # offset of the index, MAGIC
+_packs = {}  # {path: YearPack}, reopened when the file changes
+
+
+class YearPack:
+    """
+    All records of one closed year in a single file:
+        MAGIC | zlib compressed pickles ... | pickled index | footer
+    The index maps key -> (offset, length, header), so listing a pack reads only the index and loading a record
+    is a single seek and read.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with self.path.open('rb') as f:
+            stat = os.fstat(f.fileno())
+            self.stamp = (stat.st_mtime, stat.st_size)
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"Not a pack file: {self.path}")
+            f.seek(-_FOOTER.size, os.SEEK_END)
+            index_offset, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+            if magic != MAGIC:
+                raise ValueError(f"Broken pack file: {self.path}")
+            f.seek(index_offset)
+            self.index = pickle.loads(f.read(stat.st_size - _FOOTER.size - index_offset))
+
+    def headers(self):
+        """:return: [(key, header)]"""
+        return [(key, header) for key, (_, _, header) in self.index.items()]
+
+    def raw(self, key):
+        """:return: the compressed record"""
+        offset, length, _ = self.index[key]
+        with self.path.open('rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def read(self, key):
+        """:return: pickled bytes of the record"""
+        return zlib.decompress(self.raw(key))
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+def pack_path(directory, key):
+    """Pack holding the key: <directory>/20yy.pack, yy being the first two digits of the key."""
+    return Path(directory) / f'20{key[:2]}.pack'
+
+
+def open_pack(path):
+    """
+    :return: YearPack of path, None if there is no such pack
+    """
+    path = Path(path)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        _packs.pop(path, None)
+        return None
+    pack = _packs.get(path)
+    if pack is None or pack.stamp != (stat.st_mtime, stat.st_size):
+        pack = YearPack(path)
+        _packs[path] = pack
+    return pack
+
+
+def read_packed(directory, key):
+    """
+    :return: pickled bytes of the key from its year pack, None if it is not packed
+    """
+    pack = open_pack(pack_path(directory, key))
+    if pack is None or key not in pack:
+        return None
+    return pack.read(key)
+
+
+def is_packed(directory, key):
+    pack = open_pack(pack_path(directory, key))
+    return pack is not None and key in pack
+
+
+def write_pack(path, records):
+    """
+    Atomically replace the pack at path.
+    :param records: [(key, compressed record, header)]
+    """
+    path = Path(path)
+    index = {}
+    tmp_path = path.with_suffix('.packtmp')
+    with tmp_path.open('wb') as f:
+        f.write(MAGIC)
+        for key, blob, header in records:
+            index[key] = (f.tell(), len(blob), header)
+            f.write(blob)
+        index_offset = f.tell()
+        pickle.dump(index, f)
+        f.write(_FOOTER.pack(index_offset, MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    logging.info(f"Write pack of {len(index)} record(s): {path.resolve()}")
+
+
+def pack_files(path, files):
+    """
+    Add loose files to the pack at path. A loose file replaces the packed record of the same key; the loose
+    files are removed once the pack is written.
+    :param files: {key: header}, the files are <pack directory>/<key>.data
+    :return: number of packed files
+    """
+    path = Path(path)
+    pack = open_pack(path)
+    records = {}
+    if pack is not None:
+        records = {key: (pack.raw(key), header) for key, header in pack.headers()}
+    for key, header in files.items():
+        with (path.parent / f'{key}.data').open('rb') as f:
+            records[key] = (zlib.compress(f.read()), header)
+    write_pack(path, [(key, blob, header) for key, (blob, header) in sorted(records.items())])
+    for key in files:
+        (path.parent / f'{key}.data').unlink()
+    return len(files)
+
+
+def remove_packed(directory, key):
+    """Rewrite the year pack without the key, the pack is removed when it becomes empty."""
+    path = pack_path(directory, key)
+    pack = open_pack(path)
+    if pack is None or key not in pack:
+        return
+    records = [(k, pack.raw(k), header) for k, header in pack.headers() if k != key]
+    if records:
+        write_pack(path, records)
+    else:
+        logging.info(f"Remove empty pack: {path.resolve()}")
+        path.unlink()
+        _packs.pop(path, None)
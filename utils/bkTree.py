@@ -0,0 +1,117 @@
+def edit_distance(a, b):
+    """Levenshtein distance of a and b, bit-parallel (Myers / Hyyrö): one pass of integer operations per
+    character of the longer string."""
+    if len(a) < len(b):
+        a, b = b, a
+    if not b:
+        return len(a)
+    peq = {}  # {character: bit mask of its positions in b}
+    for i, c in enumerate(b):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    last = 1 << (len(b) - 1)
+    full = (1 << len(b)) - 1
+    pv, mv, score = full, 0, len(b)
+    for c in a:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & full
+        mv = ph & xv & full
+    return score
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree of strings under edit distance, each string carrying a set of keys (pids).
+    A query only visits children whose edge distance is within the search radius of the query's distance to
+    their parent (triangle inequality), so it does not compare the query with every string.
+    Removing a key leaves its node in place; the tree is rebuilt when most nodes are empty.
+    """
+
+    def __init__(self):
+        self.root = None  # [text, {distance: child node}]
+        self.keys = {}  # {text: {key}}
+        self._nodes = 0
+        self._live = 0  # nodes whose key set is not empty
+
+    def add(self, text, key):
+        if text in self.keys:
+            if not self.keys[text]:
+                self._live += 1
+            self.keys[text].add(key)
+            return
+        self.keys[text] = {key}
+        self._nodes += 1
+        self._live += 1
+        if self.root is None:
+            self.root = [text, {}]
+            return
+        node = self.root
+        while True:
+            d = edit_distance(text, node[0])
+            if d in node[1]:
+                node = node[1][d]
+            else:
+                node[1][d] = [text, {}]
+                return
+
+    def remove(self, text, key):
+        keys = self.keys.get(text)
+        if keys is None or key not in keys:
+            return
+        keys.remove(key)
+        if keys:
+            return
+        self._live -= 1
+        if self._live * 2 < self._nodes:
+            self.rebuild([(t, k) for t, ks in self.keys.items() for k in ks])
+
+    def rebuild(self, items):
+        """:param items: [(text, key)]"""
+        self.root = None
+        self.keys = {}
+        self._nodes = 0
+        self._live = 0
+        for text, key in items:
+            self.add(text, key)
+
+    def nearest(self, text, k=20, max_distance=None):
+        """
+        The radius grows from 1 until k strings are found, close matches therefore only visit a small part of
+        the tree. Radii above 2 visit most of a large tree, so that is the default limit.
+        :param max_distance: default 2, 1 for texts of up to 4 characters
+        :return: [(distance, text, keys)] of the k nearest non-empty strings, nearest first
+        """
+        if self.root is None:
+            return []
+        if max_distance is None:
+            max_distance = 2 if len(text) > 4 else 1
+        found = []
+        for radius in range(1, max_distance + 1):
+            found = self._within(text, radius)
+            if len(found) >= k:
+                break
+        found.sort()
+        return [(d, t, self.keys[t]) for d, t in found[:k]]
+
+    def _within(self, text, radius):
+        """:return: [(distance, text)] of the non-empty strings within radius"""
+        found = []
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            d = edit_distance(text, node[0])
+            if d <= radius and self.keys[node[0]]:
+                found.append((d, node[0]))
+            for edge, child in node[1].items():
+                if d - radius <= edge <= d + radius:
+                    stack.append(child)
+        return found
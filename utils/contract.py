@@ -4,6 +4,7 @@ import datetime
 import pickle
 from pathlib import Path
 from utils.exception import ContractNumberAlreadyExist, IllegalDate, FileExceed
+from utils import archive, snapshotStore, money
 
 
 class Contract:
@@ -46,7 +47,10 @@ class Contract:
         self._new = True
         self._modify = True
 
-        self.table = []  # [(product, quantity, discount)]
+        self.table = []  # [(product, quantity, discount, comment)]
+        self._total_amount = 0  # running totals of table, kept by the methods changing it, exact in fen
+        self._total_quantity = 0
+        self._saved_total_fen = None  # total of a file saved before the exact total was kept, until the table changes
 
     def set_modify(self):
         self._modify = True
@@ -69,6 +73,9 @@ class Contract:
     def add_item(self, product, quantity, discount, comments):
         logging.debug(f"Add line: {product}")
         self.table.append((product, quantity, discount, comments))
+        self._total_amount += money.line_amount(product, quantity, discount)
+        self._total_quantity += quantity
+        self._saved_total_fen = None
         self._modify = True
 
     def move_product(self, start_line, dest_line):
@@ -88,7 +95,10 @@ class Contract:
 
     def del_item(self, line_number):
         logging.debug(f"Del line: {line_number}")
-        del self.table[line_number]
+        product, quantity, discount, _ = self.table.pop(line_number)
+        self._total_amount -= money.line_amount(product, quantity, discount)
+        self._total_quantity -= quantity
+        self._saved_total_fen = None
         self._modify = True
 
     def get_sign_date(self):
@@ -126,21 +136,32 @@ class Contract:
     def get_supplier(self):
         return self.supplier if self.supplier else ' '
 
+    def set_table(self, table):
+        """:param table: [(product, quantity, discount, comment)]"""
+        self.table = table
+        self._count_totals()
+        self._modify = True
+
+    def _count_totals(self):
+        self._total_amount = sum(money.line_amount(*line[:3]) for line in self.table)
+        self._total_quantity = sum(line[1] for line in self.table)
+        self._saved_total_fen = None
+
     def get_total_quantity(self):
-        total = 0
-        for line in self.table:
-            total += line[1]
-        return total
+        return self._total_quantity
 
     def get_total(self):
-        total = 0
-        for line in self.table:
-            p = line[0]
-            total += line[1] * (p.get_raw_price() * line[2] + p.get_adjunct_price())
-        return round(total, 2)
+        """:return: yuan, exact to the fen"""
+        return money.to_yuan(self.get_total_fen())
+
+    def get_total_fen(self):
+        """:return: total of the table rounded to the fen, lines are summed unrounded"""
+        if self._saved_total_fen is not None:
+            return self._saved_total_fen
+        return money.round_fen(self._total_amount)
 
     def get_total_daxie(self):
-        return numToBig(self.get_total())
+        return money.to_daxie(self.get_total_fen())
 
     def get_brand(self):
         return [(self.brand if self.brand else ' ', self.get_total())]
@@ -188,7 +209,11 @@ class Contract:
     def set_template(self, set_t: bool):
         self._is_template = set_t
 
-    def save(self, dir='data/contract'):
+    def save(self, dir='data/contract', writer=None):
+        """
+        :param dir: directory of contracts and templates
+        :param writer: PersistenceQueue, if given the file is written in background
+        """
         p = Path(dir)
         if self._is_template:
             p = p / 'template'
@@ -216,14 +241,26 @@ class Contract:
             logging.debug(f"Create saving directory: {p.resolve()}")
             p.mkdir(parents=True)
         p = p / f'{self.cid}.data'
-        if p.exists() and self._new:
+        if self._new and (p.exists() or (writer and writer.pending(p)[1] is not None) or
+                          (not self._is_template and archive.is_packed(p.parent, self.cid))):
             raise ContractNumberAlreadyExist
         self._new = False
         if self._modify:
             self._modify = False
+            # Table lines reference products in the snapshot store shared with quotes: data/snapshots.data
+            store_path = Path(dir).parent / 'snapshots.data'
+            state = snapshotStore.dump_state(self.__dict__, store_path)
+            sync = snapshotStore.open_store(store_path).sync  # the snapshots reach the disk first
+            if writer:
+                logging.debug(f"Queue data: {p.resolve()}")
+                writer.submit(p, pickle.dumps(state), before=sync)
+                return
             logging.debug(f"Save data: {p.resolve()}")
-            with p.open('wb') as f:
-                pickle.dump(self.__dict__, f)
+            sync()
+            tmp_path = p.with_suffix('.tmp')
+            with tmp_path.open('wb') as f:
+                pickle.dump(state, f)
+            os.replace(tmp_path, p)
         else:
             logging.debug(f"No modify, did not save: {p.resolve()}")
 
@@ -231,7 +268,7 @@ class Contract:
         self.name = name
         self._modify = True
 
-    def delete(self, dir='data/contract'):
+    def delete(self, dir='data/contract', writer=None):
         cid = self.cid
         p = Path(dir)
         if cid.startswith('0000'):
@@ -239,26 +276,45 @@ class Contract:
         else:
             p = p / 'contract'
         p = p / f'{str(cid)}.data'
-        if p.exists():
+        if writer:
+            writer.delete(p)
+        elif p.exists():
             logging.debug(f"Delete contract: {p.resolve()}")
             p.unlink()
+        archive.remove_packed(p.parent, cid)
 
     @staticmethod
-    def load(cid, dir='data/contract'):
+    def load(cid, dir='data/contract', writer=None):
+        """
+        :param writer: PersistenceQueue, a write still waiting in it is returned instead of the file
+        A contract without a loose file is read from the year pack.
+        """
         c = Contract()
         if cid.startswith('0000'):
             p = Path(dir) / 'template' / f'{str(cid)}.data'
-            assert p.exists(), f"No existing file: {p}"
-            with p.open('rb') as pkl_file:
-                c.__dict__ = pickle.load(pkl_file)
-            logging.debug(f"Load template from file: {p.resolve()}")
         else:
             p = Path(dir) / 'contract' / f'{str(cid)}.data'
-            assert p.exists(), f"No existing file: {p}"
+        store_path = Path(dir).parent / 'snapshots.data'
+        queued, data = writer.pending(p) if writer else (False, None)
+        if queued:
+            assert data is not None, f"File deleted: {p}"
+            c.__dict__ = snapshotStore.load_state(pickle.loads(data), store_path)
+            logging.debug(f"Load queued data: {p.resolve()}")
+        elif p.exists():
             with p.open('rb') as pkl_file:
-                c.__dict__ = pickle.load(pkl_file)
-            logging.debug(f"Load contract from file: {p.resolve()}")
+                c.__dict__ = snapshotStore.load_state(pickle.load(pkl_file), store_path)
+            logging.debug(f"Load {'template' if cid.startswith('0000') else 'contract'} from file: {p.resolve()}")
+        else:
+            data = archive.read_packed(p.parent, cid)
+            assert data is not None, f"No existing file: {p}"
+            c.__dict__ = snapshotStore.load_state(pickle.loads(data), store_path)
+            logging.debug(f"Load contract from pack: {archive.pack_path(p.parent, cid).resolve()}")
         c._new = False
+        if '_total_amount' not in c.__dict__:
+            c._count_totals()  # saved before the exact running total was kept
+            total_fen = money.float_total(c.table)
+            if total_fen != c.get_total_fen():
+                c._saved_total_fen = total_fen  # keep the amount the contract was signed with
         c._modify = False
         return c
 
@@ -291,56 +347,8 @@ class Contract:
 
 
 def numToBig(num):
-    dict1 = {1: '壹', 2: '贰', 3: '叁', 4: '肆', 5: '伍', 6: '陆', 7: '柒', 8: '捌', 9: '玖', 0: '零'}
-    dict2 = {2: '拾', 3: '佰', 4: '仟', 5: '万', 6: '拾', 7: '佰', 8: '仟', 1: '元', 9: '角', 10: '分', 11: '整'}
-    money = ''  # 最终大写数字
-    flag = False  # 去掉多余的十百千
-    flag2 = False  # 增加零
-    ifint = False  # 整
-    count = 0
-    count2 = 8
-    if int(num) == num:
-        num = int(num)
-    strnum = str(num)
-
-    aa = strnum.split('.')
-    bb = list(str(aa[:1])[2:-2])
-    cc = list(str(aa[1:])[2:-2])
-    # 此处控制：无小数时输出xxx元整
-    # 若要求一位小数也带整，即xxx元整并且xxx元xx角整，则修改下方0为1
-    if len(cc) <= 0:
-        ifint = True
-    else:
-        ifint = False
-    # 整数部分
-    for i in reversed(bb):
-        count = count + 1
-        if (int(i) == 0):
-            if (flag == True):
-                if (count != 5):
-                    continue
-                else:
-                    money = dict2[count] + money
-            else:
-                if (flag2 == False):
-                    money = dict2[count] + money
-                else:
-                    if (count != 5):
-                        money = '零' + money
-                    else:
-                        money = dict2[count] + '零' + money
-            flag = True
-        else:
-            flag = False
-            flag2 = True
-            money = dict1[int(i)] + dict2[count] + money
-    # 小数部分
-    for i in cc:
-        count2 = count2 + 1
-        money = money + dict1[int(i)] + dict2[count2]
-    if (ifint == True):
-        money = money + '整'
-    return money
+    """Chinese uppercase of an amount in yuan, see utils.money.to_daxie"""
+    return money.to_daxie(money.to_fen(num))
 
 
 if __name__ == '__main__':
@@ -1,4 +1,16 @@
 from utils.contract import Contract
+from utils.fileIndex import FileIndex
+from utils.persistence import PersistenceQueue
+from utils import money
+from utils.textIndex import TextIndex
+from utils.usageIndex import UsageIndex
+from utils.numberAllocator import NumberAllocator
+from utils.salesCube import SalesCube
+try:
+    from utils.analytics import SalesAnalytics
+except ImportError:  # numpy is not installed, sales analytics are unavailable
+    SalesAnalytics = None
+from utils import pinyin
 from pathlib import Path
 import datetime
 import logging
@@ -16,74 +28,131 @@ def _return_information(c):
            c.buyer_tel, c.name, c.cid
 
 
-class ContractLoader:
+def _contract_header(c):
+    """Fields served by the folder views and the searches without unpickling the contract."""
+    return {'name': c.get_name(), 'sign_date': (str(c.sign_date.year), str(c.sign_date.month), str(c.sign_date.day)),
+            'total_fen': c.get_total_fen(), 'quantity': c.get_total_quantity(), 'brand': c.brand,
+            'buyer': c.buyer, 'supplier': c.supplier,
+            'party_pinyin': pinyin.search_keys(c.buyer) + pinyin.search_keys(c.supplier), 'text': _contract_text(c),
+            'products': tuple(line[0].get_key() for line in c.table)}
 
-    def __init__(self, data_dir='data/contract'):
-        self.contracts = {}
-        self.templates = {}
-        self.template_order = []
-        self.data_dir = data_dir
 
-        # load contracts
-        contracts_path = Path(data_dir) / 'contract'
-        if contracts_path.exists():
-            for f in contracts_path.iterdir():
-                cid = f.stem
-                if f.suffix == '.data' and isLegalCid(cid):
-                    self.contracts[cid] = Contract.load(cid, data_dir)
-
-        # load templates
-        template_path = Path(data_dir) / 'template'
-        if template_path.exists():
-            for f in template_path.iterdir():
-                cid = f.stem
-                if f.suffix == '.data' and isLegalCid(cid):
-                    self.templates[cid] = Contract.load(cid, data_dir)
+def _contract_text(c):
+    """Texts of a contract the full-text search looks at besides its name and parties."""
+    texts = (c.cid, c.brand, c.delivery_date, c.delivery_location, c.location, c.payment_method, c.comments,
+             *c.others, c.supplier_location, c.supplier_bank, c.supplier_account, c.supplier_tax_num,
+             c.supplier_tel, c.buyer_location, c.buyer_bank, c.buyer_account, c.buyer_tax_num, c.buyer_tel,
+             *(line[3] for line in c.table))
+    return tuple(text for text in texts if text and isinstance(text, str))
+
+
+def _number(cid):
+    """Group and sequence number of a cid in the number table: ('yymm', last two) or ('0000', template slot)."""
+    return cid[:4], int(cid[6:8])
 
-        # load templates' order
-        order_path = Path(data_dir) / 'templates.data'
-        if order_path.exists():
-            with order_path.open('rb') as f:
-                self.template_order = pickle.load(f)
-        to_be_deleted = []
-        for i in range(len(self.template_order)):
-            if self.template_order[i] not in self.templates:
-                to_be_deleted.append(i)
-        to_be_deleted.reverse()
-        for i in to_be_deleted:
-            del self.template_order[i]
-        for cid in self.templates:
-            if cid not in self.template_order:
-                self.template_order.append(cid)
 
-    def refresh(self):
+def _text_fields(header):
+    return ((3, header['name']), (3, header['buyer']), (3, header['supplier'])) + \
+           tuple((3, i) for i in header['party_pinyin']) + tuple((1, i) for i in header['text'])
+
+
+class ContractLoader:
+
+    def __init__(self, data_dir='data/contract', capacity=32):
         """
-        Refresh from file.
-        :return:
+        :param data_dir: directory of contracts and templates
+        :param capacity: number of full contracts kept in memory, the rest only keep their header
         """
-        self.contracts = {}
-        self.templates = {}
+        self.data_dir = data_dir
+        self.writer = PersistenceQueue()
+        self.contracts = FileIndex(Path(data_dir) / 'contract', Path(data_dir) / 'contract_index.data',
+                                   self._load_contract, _contract_header, isLegalCid, capacity, version=7,
+                                   writer=self.writer)
+        self.templates = FileIndex(Path(data_dir) / 'template', Path(data_dir) / 'template_index.data',
+                                   self._load_contract, _contract_header, isLegalCid, capacity, version=7,
+                                   writer=self.writer)
         self.template_order = []
-
-        # load contracts
-        contracts_path = Path(self.data_dir) / 'contract'
-        if contracts_path.exists():
-            for f in contracts_path.iterdir():
-                cid = f.stem
-                if f.suffix == '.data' and isLegalCid(cid):
-                    self.contracts[cid] = Contract.load(cid, self.data_dir)
-
-        # load templates
-        template_path = Path(self.data_dir) / 'template'
-        if template_path.exists():
-            for f in template_path.iterdir():
-                cid = f.stem
-                if f.suffix == '.data' and isLegalCid(cid):
-                    self.templates[cid] = Contract.load(cid, self.data_dir)
+        self.numbers = NumberAllocator(Path(data_dir) / 'contract_numbers.data')  # used numbers per month
+        self.text_index = None  # TextIndex of contracts, loaded on the first search()
+        self.text_index_path = Path(data_dir) / 'contract_text.data'
+        self.usage_index = UsageIndex()  # product key -> lines of contracts using it
+        self.usage_index.rebuild((cid, header['products']) for cid, header in self.contracts.headers.items())
+        self.sales = SalesCube()  # statistics per year and month
+        self.sales.rebuild(self.contracts.headers)
+        self.sales_analytics = None  # SalesAnalytics of contract lines, loaded on the first analytics()
+        self.sales_analytics_path = Path(data_dir) / 'contract_analytics.data'
+        self.contracts.observers.append(self._header_changed)
+        self.refresh(force=False)
+
+    def _load_contract(self, cid):
+        return Contract.load(cid, self.data_dir, self.writer)
+
+    def _header_changed(self, cid, header):
+        self.usage_index.remove(cid)
+        self.sales.set(cid, header)
+        if header is not None:
+            self.usage_index.set(cid, header['products'])
+        if self.text_index is not None:
+            if header is None:
+                self.text_index.remove(cid)
+            else:
+                self.text_index.add(cid, header)
+        if self.sales_analytics is not None:
+            self.sales_analytics.set(cid, header)
+
+    def search(self, keyword, limit=100):
+        """
+        Full-text search of contracts of every year: name, parties (also by their pinyin initials or full
+        pinyin), their addresses, banks, accounts, tax and phone numbers, terms, comments and line comments.
+        Every word of keyword must appear.
+        :param limit: number of results, all if None
+        :return: [(cid, contract's name)], most relevant first
+        """
+        if self.text_index is None:
+            self.text_index = TextIndex.load(self.text_index_path, _text_fields)
+            self.text_index.sync(self.contracts.headers)
+        return [(cid, self.contracts.header(cid)['name']) for cid, _ in self.text_index.search(keyword, limit)]
+
+    def where_used(self, product):
+        """
+        :param product: Product
+        :return: [(cid, contract's name, [line number])] of contracts containing the product, newest first,
+                 line numbers start from 1
+        """
+        return [(cid, self.contracts.header(cid)['name'], [i + 1 for i in lines])
+                for cid, lines in self.usage_index.where_used(product.get_key())]
+
+    def _table_changed(self, cid):
+        if cid in self.contracts:
+            self.usage_index.set(cid, (line[0].get_key() for line in self.contracts[cid].get_table()))
+
+    def refresh(self, force=True):
+        """
+        Refresh from file. Files are compared with the last known (mtime, size), only added or changed files
+        are loaded again and deleted ones are dropped.
+        :param force: stat every file even if the directory mtime did not change
+        :return: {'added': [cid], 'changed': [cid], 'removed': [cid]} of contracts and templates
+        """
+        report = {'added': [], 'changed': [], 'removed': []}
+        for index in (self.contracts, self.templates):
+            added, changed, removed = index.scan(force)
+            report['added'] += added
+            report['changed'] += changed
+            report['removed'] += removed
+        if not self.numbers.exists():
+            self.numbers.update(used=[_number(cid) for index in (self.contracts, self.templates) for cid in index])
+        elif report['added'] or report['removed']:
+            # files created or deleted by another client, or by hand
+            self.numbers.update(used=[_number(cid) for cid in report['added']],
+                                released=[_number(cid) for cid in report['removed']])
 
         # load templates' order
+        self.template_order = []
         order_path = Path(self.data_dir) / 'templates.data'
-        if order_path.exists():
+        queued, data = self.writer.pending(order_path)
+        if queued:
+            self.template_order = pickle.loads(data)
+        elif order_path.exists():
             with order_path.open('rb') as f:
                 self.template_order = pickle.load(f)
         to_be_deleted = []
@@ -96,7 +165,8 @@ class ContractLoader:
         for cid in self.templates:
             if cid not in self.template_order:
                 self.template_order.append(cid)
-        logging.info("Refresh contractloader.")
+        logging.info(f"Refresh contractloader: {report}")
+        return report
 
     def export_excel(self, contract_cid, output_type, file_dir):
         """
@@ -114,7 +184,8 @@ class ContractLoader:
         :param cid: Contract to be saved
         :return: None
         """
-        self.contracts[cid].save(self.data_dir)
+        self.contracts[cid].save(self.data_dir, self.writer)
+        self.contracts.update(cid)
 
     def add_product(self, cid, product, quantity: str, discount: str, comments: str):
         """
@@ -137,6 +208,7 @@ class ContractLoader:
         if not discount:
             discount = 1
         self.contracts[cid].add_item(product, int(quantity), float(discount), comments)
+        self._table_changed(cid)
         return 0
 
     def move_product(self, cid, start_line, destination_line):
@@ -148,6 +220,7 @@ class ContractLoader:
         :return:
         """
         self.contracts[cid].move_product(start_line, destination_line)
+        self._table_changed(cid)
 
     def sort_products(self, cid):
         """
@@ -156,6 +229,7 @@ class ContractLoader:
         :return:
         """
         self.contracts[cid].table_sort()
+        self._table_changed(cid)
 
     def remove_product(self, cid, line_number):
         """
@@ -164,6 +238,7 @@ class ContractLoader:
         :return: None
         """
         self.contracts[cid].del_item(line_number)
+        self._table_changed(cid)
 
     def get_table_info(self, cid):
         """
@@ -173,11 +248,10 @@ class ContractLoader:
         """
         result = []
         for i, (product, quantity, discount, comment) in enumerate(self.contracts[cid].get_table()):
-            single_price = product.get_raw_price() * discount + product.get_adjunct_price()
-            total_price = single_price * quantity
+            single_price = money.unit_price(product.get_raw_price_fen(), discount, product.get_adjunct_price_fen())
             result.append((i + 1, product.get_name(), product.get_specs(), product.get_unit(), str(quantity),
                            product.get_raw_price(), str(discount), str(product.get_adjunct_price()),
-                           str(single_price), str(total_price), comment))
+                           money.format_price(single_price), money.format_price(single_price * quantity), comment))
         return result
 
     def get_table_total(self, cid):
@@ -193,16 +267,30 @@ class ContractLoader:
         :param date: (year, month ,None)
         :return: total of specific date, number of contract
         """
-        year = date[0]
-        month = date[1]
-        if not year:
-            result = [i for i in self.contracts.values()]
-        elif not month:
-            result = [i for i in self.contracts.values() if i.cid[:2] == year[-2:]]
-        else:
-            result = [i for i in self.contracts.values() if i.cid[:2] == year[-2:]
-                      and i.cid[2:4] == '{:0>2d}'.format(int(month))]
-        return sum([i.get_total() for i in result]), len(result)
+        return self.sales.get_total(date[0], date[1])
+
+    def get_sales(self, year=None, month=None):
+        """
+        :param year: e.g. '2021', None for all years
+        :param month: e.g. '8', None for the whole year
+        :return: {'count', 'total', 'quantity', 'brands': {brand: total}, 'buyers': {buyer: total}} of the period
+        """
+        return self.sales.get(year, month)
+
+    def analytics(self):
+        """
+        Line level sales analytics, e.g. analytics().sum('series', year='2021') is the revenue of every product
+        series in 2021 and analytics().mean('series') the average discount of every series. The line table is
+        kept in contract_analytics.data, so only contracts saved since it was written are loaded. Needs numpy.
+        :return: SalesAnalytics
+        """
+        if self.sales_analytics is None:
+            if SalesAnalytics is None:
+                raise ImportError('Sales analytics need numpy')
+            self.sales_analytics = SalesAnalytics.load(self.sales_analytics_path,
+                                                       lambda cid: self.contracts[cid].get_table())
+            self.sales_analytics.sync(self.contracts.headers)
+        return self.sales_analytics
 
     def get_contract_list(self, date):
         """
@@ -216,14 +304,14 @@ class ContractLoader:
         elif not month:
             return sorted({('00000000', f'{i[2:4]}') for i in self.contracts if i[:2] == year[-2:]}, key=lambda x: x[1])
         else:
-            return [(i, v.get_name()) for i, v in self.contracts.items()
+            return [(i, self.contracts.header(i)['name']) for i in self.contracts
                     if i[:2] == year[-2:] and i[2:4] == '{:0>2d}'.format(int(month))]
 
     def get_template_list(self):
         """
         :return: [(cid, contract's name)]
         """
-        return [(cid, self.templates[cid].get_name()) for cid in self.template_order]
+        return [(cid, self.templates.header(cid)['name']) for cid in self.template_order]
 
     def override_contract(self, contract_cid, supplier, buyer, brand, sign_date, delivery_date, delivery_location,
                           location, payment_method, comments, others, supplier_location, supplier_bank,
@@ -275,7 +363,8 @@ class ContractLoader:
             c.buyer_tax_num = buyer_tax_num
             c.buyer_tel = buyer_tel
             c.set_modify()
-            c.save(self.data_dir)
+            c.save(self.data_dir, self.writer)
+            self.contracts.update(contract_cid)
         elif contract_cid in self.templates:
             c = self.templates[contract_cid]
             c.supplier = supplier
@@ -298,7 +387,8 @@ class ContractLoader:
             c.buyer_tax_num = buyer_tax_num
             c.buyer_tel = buyer_tel
             c.set_modify()
-            c.save(self.data_dir)
+            c.save(self.data_dir, self.writer)
+            self.templates.update(contract_cid)
         else:
             raise ValueError(f'{contract_cid} not exist.')
 
@@ -356,9 +446,15 @@ class ContractLoader:
         c.name = name
         c.cid = contract_number
         if table:
-            c.table = table
+            c.set_table(table)
         c.set_template(False)
-        c.save(self.data_dir)
+        if not self.numbers.reserve(*_number(c.cid)):
+            raise ContractNumberAlreadyExist
+        try:
+            c.save(self.data_dir, self.writer)
+        except Exception:
+            self.numbers.release(*_number(c.cid))
+            raise
         self.contracts[c.cid] = c
         logging.info(f"Create contract: {c.cid}")
         return c.cid
@@ -370,7 +466,8 @@ class ContractLoader:
         """
         c = Contract()
         c.name = "新建模板"
-        c.save(self.data_dir)
+        c.cid = self._next_template_cid()
+        c.save(self.data_dir, self.writer)
         self.templates[c.cid] = c
         self.template_order.append(c.cid)
         self._save_template_order()
@@ -409,10 +506,12 @@ class ContractLoader:
         """
         if cid in self.contracts:
             self.contracts[cid].rename(name)
-            self.contracts[cid].save(self.data_dir)
+            self.contracts[cid].save(self.data_dir, self.writer)
+            self.contracts.update(cid)
         elif cid in self.templates:
             self.templates[cid].rename(name)
-            self.templates[cid].save(self.data_dir)
+            self.templates[cid].save(self.data_dir, self.writer)
+            self.templates.update(cid)
         else:
             raise ValueError('Cid is not exists.')
 
@@ -423,7 +522,8 @@ class ContractLoader:
         """
         c = Contract.copy(self.templates[template_cid])
         c.name = self.templates[template_cid].name + '_复制'
-        c.save(self.data_dir)
+        c.cid = self._next_template_cid()
+        c.save(self.data_dir, self.writer)
         self.templates[c.cid] = c
         self.template_order.append(c.cid)
         self._save_template_order()
@@ -435,15 +535,31 @@ class ContractLoader:
         :return
         """
         if cid in self.contracts:
-            self.contracts[cid].delete(self.data_dir)
+            self.contracts[cid].delete(self.data_dir, self.writer)
             del self.contracts[cid]
         elif cid in self.templates:
-            self.templates[cid].delete(self.data_dir)
+            self.templates[cid].delete(self.data_dir, self.writer)
             del self.templates[cid]
             self.template_order.remove(cid)
             self._save_template_order()
         else:
             raise ValueError('Cid is not exists.')
+        self.numbers.release(*_number(cid))
+
+    def archive_year(self, year):
+        """
+        Pack every contract of a closed year into data/contract/contract/<year>.pack. Archived contracts stay
+        readable and editable, an edited contract is saved as a loose file again.
+        :param year: str, e.g. '2021'
+        :return: number of archived contracts
+        """
+        if int(year) >= datetime.date.today().year:
+            raise ValueError(f'Year {year} is not closed yet.')
+        self.writer.drain()
+        self.contracts.scan(force=True)
+        count = self.contracts.archive([cid for cid in self.contracts if cid[:2] == str(year)[-2:]])
+        logging.info(f"Archive {count} contract(s) of {year}")
+        return count
 
     def generate_contract_num(self, date, last_two=None):
         """
@@ -457,12 +573,7 @@ class ContractLoader:
             raise IllegalDate
         pre_six = '{}{:0>2d}{:0>2d}'.format(str(date[0])[-2:], int(date[1]), int(date[2]))
         if not last_two:
-            biggest = 1
-            for cid in self.contracts:
-                if cid.startswith(pre_six[:4]):
-                    this_last_two = int(cid[-2:])
-                    if this_last_two >= biggest:
-                        biggest = this_last_two + 1
+            biggest = self.numbers.next_number(pre_six[:4])
             if biggest > 99:
                 raise FileExceed(f'Contracts for this month {pre_six} exceed 100.')
             last_two = '{:0>2d}'.format(biggest)
@@ -472,14 +583,40 @@ class ContractLoader:
             last_two = '{:0>2d}'.format(int(last_two))
             if len(last_two) != 2 or last_two == '00':
                 raise IllegalContractNumber
-            if last_two in [i[-2:] for i in self.contracts if i[:4] == pre_six[:4]]:
+            if self.numbers.is_used(pre_six[:4], int(last_two)):
                 raise ContractNumberAlreadyExist
         return pre_six + last_two
 
+    def _next_template_cid(self):
+        """Reserve the smallest free template slot 00000001 ~ 00000099."""
+        slot = self.numbers.allocate('0000', 99)
+        if slot is None:
+            raise FileExceed('Contracts for template exceed 99.')
+        return '000000{:0>2d}'.format(slot)
+
     def _save_template_order(self):
         order_path = Path(self.data_dir) / 'templates.data'
-        with order_path.open('wb') as f:
-            pickle.dump(self.template_order, f)
+        self.writer.submit(order_path, pickle.dumps(self.template_order))
+
+    def get_save_status(self):
+        """
+        :return: number of files waiting to be written, [(path, error)] of failed writes
+        """
+        return self.writer.get_status()
+
+    def retry_failed_saves(self):
+        self.writer.retry_failed()
+
+    def close(self):
+        """Write everything still queued, called when the application exits."""
+        self.writer.drain()
+        self.contracts.save_index()
+        self.templates.save_index()
+        if self.text_index is not None and self.text_index.changed:
+            self.writer.submit(self.text_index_path, self.text_index.dumps())
+        if self.sales_analytics is not None and self.sales_analytics.changed:
+            self.writer.submit(self.sales_analytics_path, self.sales_analytics.dumps())
+        self.writer.close()
 
     @staticmethod
     def get_today():
@@ -1,20 +1,49 @@
 from utils.exception import ProductNotExist, ProductAlreadyExist
+from utils.searchIndex import SearchIndex, matches
+from utils.bkTree import BKTree
+from utils.sortedView import SortedView
+from utils import sharedFile
 from pathlib import Path
+from collections import OrderedDict
+import threading
 import pickle
 import os
 import logging
 
 
 class DataLoader:
+    # Size of products.log (bytes) above which save() folds the journal into a new snapshot.
+    compact_threshold = 1 << 20
+    # Number of search_products results kept.
+    search_cache_size = 64
 
     def __init__(self):
         self.data = {'products': {}, 'id_count': 0}
-        self.deleted = []
+        self.deleted = set()
         self._modify = True
+        self._index = {}  # {product key: pid}
+        self._search_index = SearchIndex()  # None while it is built in the background after load
+        self._fuzzy_index = BKTree()  # upper case get_model() -> pids, None while it is built after load
+        self._pending = []  # [(op, pid, product)] index changes made while the indexes are built
+        self._index_lock = threading.Lock()
+        self._indexer = None
+        self._views = {'model': SortedView(lambda p: p.get_model()),
+                       'name': SortedView(lambda p: (p.name, p.model))}  # orders of sorted()
+        self.revision = 0  # bumped on every catalog change, cached search results of older revisions are stale
+        self._search_cache = OrderedDict()  # {(name, model, keyword, sort): (revision, result)}
+        self._journal = []  # [(op, product)] not yet appended to products.log
+        self._generation = 0
+        self._log_offset = 0
+        self._lock = threading.Lock()
+        self._compactor = None
 
     def refresh(self, data_dir = 'data'):
-        self.save(data_dir)
-        logging.info("Refresh contractloader.")
+        """
+        :return: True if changes of other clients were merged
+        """
+        changed = self.save(data_dir)
+        logging.info("Refresh dataloader.")
+        return changed
 
     def get_product(self, pid):
         if pid not in self.data['products']:
@@ -22,18 +51,25 @@ class DataLoader:
             raise ProductNotExist(f"Product id not exist: {pid}")
         return self.data['products'][pid].copy()
 
-    def get_products_list(self):
-        product_list = [(i, self.data['products'][i]) for i in self.data['products']]
-        return product_list
+    def get_products_list(self, key='model'):
+        """
+        :param key: 'model' or 'name', see sorted()
+        :return: [(pid, Product)] in the order of key
+        """
+        products = self.data['products']
+        return [(pid, products[pid]) for pid in self._views[key].pids()]
 
     def add_data(self, new_product):
-        for i in self.data['products'].values():
-            if i == new_product:
-                logging.info(f'Product already exists: {i}')
-                raise ProductAlreadyExist(f'Product already exists: {i}')
+        key = new_product.get_key()
+        if key in self._index:
+            i = self.data['products'][self._index[key]]
+            logging.info(f'Product already exists: {i}')
+            raise ProductAlreadyExist(f'Product already exists: {i}')
         logging.info(f'Add product pid {self.data["id_count"]}: {new_product}')
         self.data['products'][self.data['id_count']] = new_product
+        self._index_add(self.data['id_count'], new_product)
         self.data['id_count'] += 1
+        self._journal.append(('add', new_product))
         self._modify = True
 
     def del_data(self, pid):
@@ -42,64 +78,359 @@ class DataLoader:
             raise ProductNotExist(f"Product id not exist: {pid}")
         else:
             logging.info(f"Delete product id: {pid}, {self.data['products'][pid]}")
-            self.deleted.append(self.data['products'][pid])
+            self.deleted.add(self.data['products'][pid])
+            self._journal.append(('del', self.data['products'][pid]))
+            self._index_remove(pid, self.data['products'][pid])
             del self.data['products'][pid]
             self._modify = True
 
     def save(self, data_dir='data'):
+        """
+        Merge changes made by other clients, then append this session's changes to products.log.
+        The snapshot products.data is only rewritten when it does not exist yet or when the journal
+        grows past compact_threshold (done in a background thread).
+        :return: True if changes of other clients were merged
+        """
+        merged = False
         p = Path(data_dir)
         if not p.exists():
             logging.info(f"Create data directory: {p.resolve}")
             p.mkdir(parents=True)
-        p = p / 'products.data'
-        if p.exists():
-            with p.open('rb') as f:
-                cloud_data = pickle.load(f)
-                for product in cloud_data['products'].values():
-                    if product not in self.data['products'].values() and product not in self.deleted:
-                        logging.info(f"Update product from cloud:{product}")
-                        self.data['products'][self.data['id_count']] = product
-                        self.data['id_count'] += 1
-                        self._modify = True
-        self.deleted = []
-        if self._modify:
+        snapshot_path = p / 'products.data'
+        log_path = p / 'products.log'
+        # The lock file keeps other clients from appending while the journal is compacted and replaced.
+        with self._lock, sharedFile.file_lock(log_path):
+            if not snapshot_path.exists():
+                self._generation = 0
+                self._write_snapshot(snapshot_path, self._generation)
+                _, self._log_offset = self._write_log(log_path, self._generation, [])
+                self._journal = []
+            elif not sharedFile.is_framed(log_path) or self._read_generation(log_path) != self._generation:
+                # The journal was compacted (or never created) by someone else: merge the full copy.
+                merged = self._merge_cloud(snapshot_path, log_path)
+            else:
+                records, self._log_offset = self._read_log(log_path, self._log_offset)
+                for op, product in records:
+                    merged = self._merge(op, product) or merged
+            self.deleted = set()
+            if self._journal:
+                logging.info(f"Append {len(self._journal)} change(s) to: {log_path.resolve()}")
+                data = b''.join(sharedFile.dump_record(record) for record in self._journal)
+                with log_path.open('ab') as f:
+                    end = f.tell()
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                if end == self._log_offset:
+                    # Nothing unread before our own records: skip them, replaying a del + add pair of the same key
+                    # would give the product a new pid.
+                    self._log_offset = end + len(data)
+                self._journal = []
+            else:
+                logging.info(f"No modify, data did not save: {snapshot_path.resolve()}")
             self._modify = False
-            logging.info(f"Save data: {p.resolve()}")
-            with p.open('wb') as f:
-                pickle.dump(self.data, f)
+            need_compact = log_path.exists() and log_path.stat().st_size > self.compact_threshold
+        if need_compact and (self._compactor is None or not self._compactor.is_alive()):
+            self._compactor = threading.Thread(target=self.compact, args=(data_dir,), daemon=True)
+            self._compactor.start()
+        return merged
+
+    def compact(self, data_dir='data'):
+        """
+        Fold products.log into a new products.data snapshot and start a new journal.
+        The snapshot records up to where it folded the old journal (log_offset): if the journal is not replaced
+        after the snapshot (a crash), readers keep following the old journal from there, see _journal_start.
+        """
+        p = Path(data_dir)
+        snapshot_path = p / 'products.data'
+        log_path = p / 'products.log'
+        with self._lock:
+            generation = self._generation
+            offset = self._log_offset
+            data = {'products': dict(self.data['products']), 'id_count': self.data['id_count'],
+                    'generation': generation + 1, 'log_offset': offset}
+        tmp_path = snapshot_path.with_suffix('.tmp')
+        with tmp_path.open('wb') as f:
+            pickle.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock, sharedFile.file_lock(log_path):
+            if self._generation != generation or self._read_generation(log_path) != generation:
+                tmp_path.unlink()
+                return
+            # Records appended while the snapshot was being written are carried over to the new journal,
+            # nobody can append between reading them and replacing the journal.
+            tail, _ = self._read_log(log_path, offset)
+            os.replace(tmp_path, snapshot_path)
+            # The tail was written by other clients and is not merged yet, the next save reads it.
+            self._log_offset, _ = self._write_log(log_path, generation + 1, tail)
+            self._generation = generation + 1
+        logging.info(f"Compact data journal into: {snapshot_path.resolve()}")
+
+    def _merge_cloud(self, snapshot_path, log_path):
+        """
+        Merge the snapshot and the journal written by other clients, read directly without building a DataLoader.
+        A journal missing, older than the snapshot or written before framing is replaced by a fresh one.
+        :return: True if the catalog changed
+        """
+        with snapshot_path.open('rb') as f:
+            data = pickle.load(f)
+        generation, start = self._journal_start(data, log_path)
+        records, offset = self._read_log(log_path, start) if start is not None else ([], 0)
+        merged = False
+        for product in data['products'].values():
+            merged = self._merge('add', product) or merged
+        for op, product in records:
+            merged = self._merge(op, product) or merged
+        if start is None or not sharedFile.is_framed(log_path):
+            _, offset = self._write_log(log_path, generation, records)
+        self._generation = generation
+        self._log_offset = offset
+        return merged
+
+    @staticmethod
+    def _journal_start(data, log_path):
+        """
+        :param data: unpickled products.data
+        :return: generation of the journal following the snapshot and offset its records are replayed from,
+                 offset None if products.log does not belong to the snapshot
+        """
+        generation = data.get('generation', 0)
+        log_generation = DataLoader._read_generation(log_path)
+        if log_generation == generation:
+            return generation, 0
+        if log_generation == generation - 1 and 'log_offset' in data:
+            # A compaction stopped between replacing the snapshot and the journal: the old journal is still the
+            # one in use, the snapshot holds its records up to log_offset.
+            return log_generation, data['log_offset']
+        return generation, None
+
+    def _apply(self, op, product):
+        """Apply a journal record, return True if the catalog changed."""
+        key = product.get_key()
+        if op == 'add':
+            if key in self._index or product in self.deleted:
+                return False
+            self.data['products'][self.data['id_count']] = product
+            self._index_add(self.data['id_count'], product)
+            self.data['id_count'] += 1
+            return True
+        elif op == 'del':
+            if key in self._index:
+                pid = self._index[key]
+                self._index_remove(pid, self.data['products'][pid])
+                del self.data['products'][pid]
+                return True
+        return False
+
+    def _index_add(self, pid, product):
+        self.revision += 1
+        self._index[product.get_key()] = pid
+        self._index_search('add', pid, product)
+        for view in self._views.values():
+            view.add(pid, product)
+
+    def _index_remove(self, pid, product):
+        self.revision += 1
+        del self._index[product.get_key()]
+        self._index_search('remove', pid, product)
+        for view in self._views.values():
+            view.remove(pid, product)
+
+    def _build_index(self):
+        self.revision += 1
+        products = self.data['products']
+        self._index = {product.get_key(): pid for pid, product in products.items()}
+        for view in self._views.values():
+            view.rebuild(products)
+        # The n-gram index and the BK-tree take seconds for a large catalog: search_products scans and
+        # fuzzy_search finds nothing until they are ready.
+        with self._index_lock:
+            self._search_index = self._fuzzy_index = None
+            self._pending = []
+            self._indexer = threading.Thread(target=self._build_search_index, args=(list(products.items()),),
+                                             daemon=True)
+        self._indexer.start()
+
+    def _build_search_index(self, items):
+        """
+        Build the search index, then the BK-tree, of items off the UI thread. The changes made meanwhile are
+        applied to each before it is used.
+        """
+        index = SearchIndex()
+        index.rebuild(dict(items))
+        with self._index_lock:
+            if self._indexer is not threading.current_thread():
+                return  # replaced by a newer build
+            for op, pid, product in self._pending:
+                self._update_search_index(index, op, pid, product)
+            self._search_index = index
+        logging.info(f"Search index of {len(items)} product(s) built.")
+        tree = BKTree()
+        tree.rebuild([(p.get_model().upper(), pid) for pid, p in items])
+        with self._index_lock:
+            if self._indexer is not threading.current_thread():
+                return
+            for op, pid, product in self._pending:
+                self._update_fuzzy_index(tree, op, pid, product)
+            self._pending = []
+            self._fuzzy_index = tree
+        logging.info(f"Fuzzy index of {len(items)} product(s) built.")
+
+    def _index_search(self, op, pid, product):
+        with self._index_lock:
+            if self._search_index is not None:
+                self._update_search_index(self._search_index, op, pid, product)
+            if self._fuzzy_index is not None:
+                self._update_fuzzy_index(self._fuzzy_index, op, pid, product)
+            else:
+                self._pending.append((op, pid, product))
+
+    @staticmethod
+    def _update_search_index(index, op, pid, product):
+        if op == 'add':
+            index.add(pid, product)
         else:
-            logging.info(f"No modify, data did not save: {p.resolve()}")
+            index.remove(pid)
+
+    @staticmethod
+    def _update_fuzzy_index(tree, op, pid, product):
+        if op == 'add':
+            tree.add(product.get_model().upper(), pid)
+        else:
+            tree.remove(product.get_model().upper(), pid)
+
+    def _merge(self, op, product):
+        """Apply a journal record written by another client, return True if the catalog changed."""
+        if not self._apply(op, product):
+            return False
+        if op == 'add':
+            logging.info(f"Update product from cloud:{product}")
+        else:
+            logging.info(f"Delete product from cloud:{product}")
+        return True
+
+    def _write_snapshot(self, path, generation):
+        data = {'products': self.data['products'], 'id_count': self.data['id_count'], 'generation': generation}
+        logging.info(f"Save data: {path.resolve()}")
+        with path.open('wb') as f:
+            pickle.dump(data, f)
+
+    @staticmethod
+    def _write_log(path, generation, records):
+        """
+        Atomically replace products.log with a fresh journal.
+        :return: offset of the first record, end offset
+        """
+        tmp_path = path.with_suffix('.logtmp')
+        header = sharedFile.dump_record(('generation', generation))
+        data = header + b''.join(sharedFile.dump_record(record) for record in records)
+        with tmp_path.open('wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return len(header), len(data)
+
+    @staticmethod
+    def _read_generation(path):
+        record = sharedFile.read_first(path)
+        if isinstance(record, tuple) and len(record) == 2 and record[0] == 'generation':
+            return record[1]
+        return None
+
+    @staticmethod
+    def _read_log(path, offset=0):
+        """
+        Read journal records starting at offset. Torn records (e.g. a crashed writer) are skipped, one at the
+        end is left for the next read.
+        :return: [(op, product)], offset after the last complete record
+        """
+        records, offset = sharedFile.read_records(path, offset)
+        return [record for record in records if record[0] != 'generation'], offset
+
+    def search_products(self, name=None, model=None, keyword='', sort='model'):
+        """
+        Search the whole catalog through the n-gram index, same result as search() (ordered by sort).
+        Until the index is built after load the catalog is scanned instead.
+        Recent results are cached until the catalog changes.
+        """
+        cache_key = (name or None, model or None, keyword or '', sort)
+        cached = self._search_cache.get(cache_key)
+        if cached is not None and cached[0] == self.revision:
+            self._search_cache.move_to_end(cache_key)
+            return list(cached[1])
+        products = self.data['products']
+        index = self._search_index
+        if index is None:
+            pids = {pid for pid, p in products.items() if not keyword or matches(p, keyword)}
+        else:
+            pids = index.search(keyword or '')
+        if name or model:
+            pids = {pid for pid in pids if (not name or name == products[pid].get_name()) and
+                    (not model or model in products[pid].get_model())}
+        result = [(pid, products[pid]) for pid in self._views[sort].order(pids, products)]
+        self._search_cache[cache_key] = (self.revision, result)
+        self._search_cache.move_to_end(cache_key)
+        if len(self._search_cache) > self.search_cache_size:
+            self._search_cache.popitem(last=False)
+        return list(result)
+
+    def fuzzy_search(self, keyword, k=20, name=None):
+        """
+        Products whose model is closest to keyword by edit distance, for mistyped model numbers.
+        Nothing is found until the BK-tree built in the background after load is ready.
+        :return: [(pid, Product)] of at most k products, closest first
+        """
+        tree = self._fuzzy_index
+        if tree is None:
+            return []
+        result = []
+        for distance, model, pids in tree.nearest(keyword.upper(), k):
+            for pid in sorted(pids):
+                p = self.data['products'][pid]
+                if not name or name == p.get_name():
+                    result.append((pid, p))
+        return result[:k]
 
     @staticmethod
     def sorted(product_list, key):
         """Sort by [name] or [model]"""
         assert key == 'name' or key == 'model'
         if key == 'name':
-            product_list = sorted(product_list, key=lambda x: x[1].model)
-            product_list = sorted(product_list, key=lambda x: x[1].name)
+            product_list = sorted(product_list, key=lambda x: (x[1].name, x[1].model))
         elif key == 'model':
             product_list = sorted(product_list, key=lambda x: x[1].get_model())
         return product_list
 
     @staticmethod
     def search(product_list, name=None, model=None, keyword=None):
-        """ Search by keyword in products' model and products' name"""
+        """ Search by keyword in products' model, name and adjunct names"""
         result = []
         for p in product_list:
             if (not name or name == p[1].get_name()) and (not model or model in p[1].get_model()) and \
-                    keyword in p[1].get_model():
+                    (not keyword or matches(p[1], keyword)):
                 result.append(p)
         return DataLoader.sorted(result, 'model')
 
     @staticmethod
     def load(data_dir='data'):
         p = Path(data_dir) / 'products.data'
+        log_path = Path(data_dir) / 'products.log'
         dl = DataLoader()
         if p.exists():
-            dl = DataLoader()
             with p.open('rb') as pkl_file:
                 dl.data = pickle.load(pkl_file)
+            dl._generation, start = DataLoader._journal_start(dl.data, log_path)
+            dl.data.pop('generation', None)
+            dl.data.pop('log_offset', None)
+            dl._build_index()
             logging.info(f"Load data from file: {p.resolve()}")
+            if start is not None:
+                records, dl._log_offset = DataLoader._read_log(log_path, start)
+                for op, product in records:
+                    dl._apply(op, product)
+                logging.info(f"Replay {len(records)} change(s) from: {log_path.resolve()}")
         else:
             logging.info(f'No existing dir: use empty dataloader')
         dl._modify = False
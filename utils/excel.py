@@ -3,6 +3,7 @@ from utils.contract import Contract
 from pathlib import Path
 from utils.product import Product
 from utils.exception import FileOccupied
+from utils import money
 
 import xlsxwriter, os, logging
 
@@ -273,8 +274,11 @@ class Excel:
                 sheet2.write_number(row, col + 5, product.get_raw_price(), number_format1)  # 面价
                 sheet2.write(row, col + 6, discount, format1)  # 折扣
                 sheet2.write_number(row, col + 7, product.get_adjunct_price(), number_format1)  # 附件
-                sheet2.write_formula(row, col + 8, f'=F{row + 1}*G{row + 1}+H{row + 1}', number_format1)  # 单价
-                sheet2.write_formula(row, col + 9, f'=E{row + 1}*I{row + 1}', number_format1)  # 金额
+                single_price = money.unit_price(product.get_raw_price_fen(), discount, product.get_adjunct_price_fen())
+                sheet2.write_formula(row, col + 8, f'=F{row + 1}*G{row + 1}+H{row + 1}', number_format1,
+                                    float(single_price) / 100)  # 单价
+                sheet2.write_formula(row, col + 9, f'=E{row + 1}*I{row + 1}', number_format1,
+                                    float(single_price * number) / 100)  # 金额
                 sheet2.write(row, col + 10, comment, format1)  # 备注
                 row += 1
             for i in range(11):
@@ -334,8 +338,11 @@ class Excel:
                 sheet1.write_number(row, col + 5, product.get_raw_price(), number_format1)  # 面价
                 sheet1.write(row, col + 6, discount, format1)  # 折扣
                 sheet1.write_number(row, col + 7, product.get_adjunct_price(), number_format1)  # 附件
-                sheet1.write_formula(row, col + 8, f'=F{row + 1}*G{row + 1}+H{row + 1}', number_format1)  # 单价
-                sheet1.write_formula(row, col + 9, f'=E{row + 1}*I{row + 1}', number_format1)  # 金额
+                single_price = money.unit_price(product.get_raw_price_fen(), discount, product.get_adjunct_price_fen())
+                sheet1.write_formula(row, col + 8, f'=F{row + 1}*G{row + 1}+H{row + 1}', number_format1,
+                                    float(single_price) / 100)  # 单价
+                sheet1.write_formula(row, col + 9, f'=E{row + 1}*I{row + 1}', number_format1,
+                                    float(single_price * number) / 100)  # 金额
                 sheet1.write(row, col + 10, comment, format1)  # 备注
                 row += 1
             for i in range(11):
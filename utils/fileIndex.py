@@ -0,0 +1,244 @@
+from collections import OrderedDict
+from pathlib import Path
+from utils import archive
+import logging
+import pickle
+import os
+
+
+class FileIndex:
+    """
+    Lazily loaded {key: object} map over a directory of pickled <key>.data files.
+    A small header (dict) of every file is kept in index_path, so listings never unpickle the files; the full
+    object is loaded on first access and at most `capacity` unmodified objects stay resident.
+    Records of closed years may be moved into <year>.pack files (see utils.archive); a loose file wins over the
+    packed record of the same key.
+    """
+
+    def __init__(self, directory, index_path, load_func, header_func, key_filter=None, capacity=32, version=1,
+                 writer=None):
+        """
+        :param directory: directory of <key>.data files
+        :param index_path: file the headers are persisted to
+        :param load_func: key -> object
+        :param header_func: object -> dict of summary fields
+        :param key_filter: key -> bool, files whose stem does not pass are ignored
+        :param capacity: number of full objects kept in memory
+        :param version: bump when header_func changes, old index files are then rebuilt
+        :param writer: PersistenceQueue the files and the index are written through
+        """
+        self.directory = Path(directory)
+        self.index_path = Path(index_path)
+        self.load_func = load_func
+        self.header_func = header_func
+        self.key_filter = key_filter
+        self.capacity = capacity
+        self.version = version
+        self.writer = writer
+        self.headers = {}  # {key: header}, every header has 'mtime' and 'size' of its file, 'pack' if packed
+        self.dir_mtime = None  # mtime of directory at the last scan
+        self.observers = []  # callables (key, header or None when removed), called when a header changes
+        self._dirty = False  # headers changed since index_path was written
+        self._resident = OrderedDict()
+        self._load_index()
+
+    def _load_index(self):
+        if self.index_path.exists():
+            try:
+                with self.index_path.open('rb') as f:
+                    version, dir_mtime, headers = pickle.load(f)
+                if version == self.version:
+                    self.dir_mtime = dir_mtime
+                    self.headers = headers
+            except (EOFError, pickle.UnpicklingError, ValueError):
+                logging.warning(f"Broken index, rebuild: {self.index_path.resolve()}")
+
+    def save_index(self):
+        """
+        Write the headers if they changed since the last write. Called by scan() and when the loader is closed,
+        not on every saved file: the index is only a cache, a scan finds files written after it.
+        """
+        self.collect_written()
+        if not self._dirty:
+            return
+        self._dirty = False
+        if self.writer:
+            self.writer.submit(self.index_path, pickle.dumps((self.version, self.dir_mtime, self.headers)))
+            return
+        tmp_path = self.index_path.with_suffix('.tmp')
+        with tmp_path.open('wb') as f:
+            pickle.dump((self.version, self.dir_mtime, self.headers), f)
+        os.replace(tmp_path, self.index_path)
+
+    def scan(self, force=False):
+        """
+        Compare the directory with the index: files that are new or whose mtime/size changed are loaded again,
+        files that disappeared are dropped. Keys without a loose file are taken from the index of the year packs.
+        Files are written by replacing them, which touches the directory, so unless force is set the scan is
+        skipped when the directory mtime did not change since the last scan.
+        :return: (added keys, changed keys, removed keys)
+        """
+        self.collect_written()
+        added, changed = [], []
+        seen = set()
+        packs = []
+        dir_mtime = self.directory.stat().st_mtime if self.directory.exists() else None
+        if not force and dir_mtime is not None and dir_mtime == self.dir_mtime:
+            return added, changed, []
+        if dir_mtime is not None:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    key, suffix = os.path.splitext(entry.name)
+                    if suffix == '.pack':
+                        packs.append(entry.name)
+                        continue
+                    if suffix != '.data' or (self.key_filter and not self.key_filter(key)):
+                        continue
+                    seen.add(key)
+                    if self._queued(key):
+                        continue  # our own newer version has not reached the disk yet
+                    stat = entry.stat()
+                    header = self.headers.get(key)
+                    if header and 'pack' not in header and header['mtime'] == stat.st_mtime and \
+                            header['size'] == stat.st_size:
+                        continue
+                    obj = self._reload(key)
+                    self._set_header(key, dict(self.header_func(obj), mtime=stat.st_mtime, size=stat.st_size))
+                    (changed if header else added).append(key)
+        for name in packs:
+            pack = archive.open_pack(self.directory / name)
+            if pack is None:
+                continue
+            for key, pack_header in pack.headers():
+                if key in seen or (self.key_filter and not self.key_filter(key)):
+                    continue
+                seen.add(key)
+                if self._queued(key):
+                    continue
+                header = self.headers.get(key)
+                if header and header.get('pack') == name:
+                    # Packed records never change, only the pack around them (when others are added or removed).
+                    header['mtime'], header['size'] = pack.stamp
+                    continue
+                if not getattr(self._resident.get(key), '_modify', False):
+                    self._resident.pop(key, None)
+                if pack_header.get('_version') != self.version:
+                    pack_header = self.header_func(self._reload(key))  # packed with an older header_func
+                self._set_header(key, dict(pack_header, pack=name, mtime=pack.stamp[0], size=pack.stamp[1]))
+                (changed if header else added).append(key)
+        removed = [key for key in self.headers if key not in seen and not self._queued(key)]
+        for key in removed:
+            self._set_header(key, None)
+            self._resident.pop(key, None)
+        if added or changed or removed or dir_mtime != self.dir_mtime:
+            self.dir_mtime = dir_mtime
+            self._dirty = True
+            logging.debug(f"Index {self.directory}: {len(added)} added, {len(changed)} changed, "
+                          f"{len(removed)} removed")
+        self.save_index()
+        return added, changed, removed
+
+    def archive(self, keys):
+        """
+        Move the files of keys into their year packs, the headers are kept in the pack index.
+        Pending writes must be drained before.
+        :return: number of archived files
+        """
+        groups = {}
+        for key in keys:
+            if 'pack' in self.headers[key]:
+                continue
+            header = {k: v for k, v in self.headers[key].items() if k not in ('mtime', 'size')}
+            header['_version'] = self.version
+            groups.setdefault(archive.pack_path(self.directory, key), {})[key] = header
+        count = 0
+        for path, files in groups.items():
+            count += archive.pack_files(path, files)
+        self.scan(force=True)
+        return count
+
+    def _set_header(self, key, header):
+        """Set (None: remove) the header of key and tell the observers."""
+        if header is None:
+            del self.headers[key]
+        else:
+            self.headers[key] = header
+        self._dirty = True
+        for observer in self.observers:
+            observer(key, header)
+
+    def _reload(self, key):
+        obj = self.load_func(key)
+        self._resident[key] = obj
+        self._resident.move_to_end(key)
+        self._evict()
+        return obj
+
+    def _evict(self):
+        if len(self._resident) <= self.capacity:
+            return
+        for key in list(self._resident):
+            if len(self._resident) <= self.capacity:
+                break
+            if not getattr(self._resident[key], '_modify', False):
+                del self._resident[key]
+
+    def _queued(self, key):
+        """True if the writer still holds data (not a deletion) for the key."""
+        if not self.writer:
+            return False
+        queued, data = self.writer.pending(self.directory / f'{key}.data')
+        return queued and data is not None
+
+    def collect_written(self):
+        """Take mtime and size of files the writer finished writing since the headers were updated."""
+        if not self.writer:
+            return
+        for path, stat in self.writer.pop_written(self.directory).items():
+            header = self.headers.get(path.stem)
+            if header is not None:
+                header['mtime'] = stat.st_mtime
+                header['size'] = stat.st_size
+                self._dirty = True
+
+    def header(self, key):
+        return self.headers[key]
+
+    def update(self, key, obj=None):
+        """Refresh the header of an object after it was saved."""
+        if obj is None:
+            obj = self._resident[key]
+        p = self.directory / f'{key}.data'
+        if self.writer and self.writer.pending(p)[0]:
+            stat = None  # filled in by collect_written once the file is written
+        else:
+            stat = p.stat() if p.exists() else None
+        self._set_header(key, dict(self.header_func(obj), mtime=stat.st_mtime if stat else None,
+                                   size=stat.st_size if stat else None))
+
+    def __getitem__(self, key):
+        if key in self._resident:
+            self._resident.move_to_end(key)
+            return self._resident[key]
+        if key not in self.headers:
+            raise KeyError(key)
+        return self._reload(key)
+
+    def __setitem__(self, key, obj):
+        self._resident[key] = obj
+        self._resident.move_to_end(key)
+        self.update(key, obj)
+        self._evict()
+
+    def __delitem__(self, key):
+        self._set_header(key, None)
+        self._resident.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self.headers
+
+    def __iter__(self):
+        return iter(list(self.headers))
+
+    def __len__(self):
+        return len(self.headers)
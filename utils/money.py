@@ -0,0 +1,139 @@
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+
+_ONE = Decimal(1)
+
+
+def to_fen(yuan):
+    """
+    Amount in yuan (float, int or str) -> integer fen, rounded half up from the amount as it is written,
+    so 1.005 gives 101 although the float is slightly below it.
+    """
+    return int((Decimal(str(yuan)) * 100).quantize(_ONE, ROUND_HALF_UP))
+
+
+def to_yuan(fen):
+    """Integer fen -> yuan as float, whose str() shows at most two decimals."""
+    return fen / 100
+
+
+def format_yuan(fen):
+    """12345 -> '123.45'"""
+    return f"{'-' if fen < 0 else ''}{abs(fen) // 100}.{abs(fen) % 100:0>2d}"
+
+
+def round_fen(amount):
+    """Exact amount in fen (Decimal or int) -> integer fen, rounded half up"""
+    return int(Decimal(amount).quantize(_ONE, ROUND_HALF_UP))
+
+
+def format_price(amount):
+    """Exact amount in fen -> yuan with at least two decimals, Decimal('13519.8') -> '135.198'"""
+    yuan = (Decimal(amount) / 100).normalize()
+    if yuan.as_tuple().exponent > -2:
+        yuan = yuan.quantize(Decimal('0.01'))
+    return f'{yuan:f}'
+
+
+@lru_cache(maxsize=1 << 14)
+def unit_price(raw_fen, discount, adjunct_fen):
+    """
+    Exact price of one unit of a table line in fen: face price times discount plus the adjuncts, not rounded.
+    :param discount: float as entered, e.g. 0.85
+    :return: Decimal
+    """
+    return raw_fen * Decimal(str(discount)) + adjunct_fen
+
+
+def line_amount(product, quantity, discount):
+    """
+    :return: exact amount of a table line in fen (Decimal). Like the float amounts before, lines are not rounded,
+             the total of a table is rounded once (see round_fen).
+    """
+    return quantity * unit_price(product.get_raw_price_fen(), discount, product.get_adjunct_price_fen())
+
+
+def line_total(product, quantity, discount):
+    """:return: amount of a table line rounded to the fen"""
+    return round_fen(line_amount(product, quantity, discount))
+
+
+def float_total(table):
+    """
+    Total of a table in fen as computed before amounts were kept in fen: float line amounts summed in table order,
+    then round(total, 2). It differs from round_fen of the exact sum by a fen when that sum ends in half a fen.
+    :param table: [(product, quantity, discount, comment)]
+    """
+    total = 0
+    for product, quantity, discount, _ in table:
+        total += quantity * (product.get_raw_price() * discount + float(sum(price for _, price in product.adjunct)))
+    return to_fen(round(total, 2))
+
+
+_DIGITS = '零壹贰叁肆伍陆柒捌玖'
+_PLACES = ('仟', '佰', '拾', '')
+_SECTION_UNITS = ('', '万', '亿', '万亿')
+
+
+@lru_cache(maxsize=None)
+def _section(n):
+    """Uppercase of a 4 digits section 1 ~ 9999 without its unit, one 零 per inner run of zeros: 1010 -> 壹仟零壹拾"""
+    parts = []
+    zero = False
+    for digit, place in zip('{:0>4d}'.format(n), _PLACES):
+        if digit == '0':
+            zero = bool(parts)
+        else:
+            if zero:
+                parts.append('零')
+                zero = False
+            parts.append(_DIGITS[int(digit)] + place)
+    return ''.join(parts)
+
+
+@lru_cache(maxsize=1 << 12)
+def to_daxie(fen):
+    """
+    Chinese uppercase of an amount for contracts, up to 万亿, e.g. (in fen)
+    10700053 -> 壹拾万零柒仟元伍角叁分, 32504 -> 叁佰贰拾伍元零肆分, 120000 -> 壹仟贰佰元整, 30 -> 叁角
+    Yuan are written 4 digits at a time from cached sections; a run of zeros followed by a non-zero digit gives
+    one 零, also when the run crosses a 万 or 亿 boundary.
+    :param fen: integer amount in fen
+    """
+    if fen < 0:
+        return '负' + to_daxie(-fen)
+    yuan, jiao, fen = fen // 100, fen // 10 % 10, fen % 10
+    if yuan >= 10 ** 16:
+        raise ValueError(f'Amount too large: {yuan}')
+    parts = []
+    if yuan:
+        sections = []
+        while yuan:
+            yuan, section = divmod(yuan, 10000)
+            sections.append(section)
+        zero = False
+        for i in range(len(sections) - 1, -1, -1):
+            section = sections[i]
+            if not section:
+                zero = bool(parts)
+                continue
+            if parts and (zero or section < 1000):
+                parts.append('零')
+            parts.append(_section(section) + _SECTION_UNITS[i])
+            zero = section % 10 == 0
+        parts.append('元')
+    if jiao:
+        parts.append(_DIGITS[jiao] + '角')
+    elif fen and parts:
+        parts.append('零')
+    if fen:
+        parts.append(_DIGITS[fen] + '分')
+    elif not jiao:
+        parts.append('整' if parts else '零元整')
+    return ''.join(parts)
+
+
+def to_daxie_list(fens):
+    """Uppercase of a column of amounts, each distinct amount is converted once."""
+    cache = {}
+    return [cache[fen] if fen in cache else cache.setdefault(fen, to_daxie(fen)) for fen in fens]
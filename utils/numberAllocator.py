@@ -0,0 +1,120 @@
+from contextlib import contextmanager
+from pathlib import Path
+from utils import sharedFile
+import logging
+import pickle
+import os
+
+
+class NumberAllocator:
+    """
+    Persistent table of used sequence numbers per group, e.g. the last two digits of contract numbers per month
+    ('yymm') and the template slots ('0000'). A group is a bitmap (int) whose bit n is set when number n is used,
+    so checking a number, the next number after the biggest one and the smallest free one are constant time.
+    Clients sharing the data directory change the table under a lock file and reload it when another client
+    wrote it since.
+    """
+    lock_timeout = 5  # seconds waited for another client's lock
+    stale_lock = 30  # seconds after which a lock is considered left by a crashed client
+
+    def __init__(self, path):
+        """
+        :param path: file the table is persisted to, <path>.lock is the lock file
+        """
+        self.path = Path(path)
+        self.groups = {}  # {group: bitmap of used numbers}
+        self._stamp = None  # (mtime_ns, size) of path when groups were read or written
+        self._reload()
+
+    def exists(self):
+        """False if the table was never persisted and has to be built from the existing files."""
+        return self._stamp is not None
+
+    def _reload(self):
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return
+        try:
+            with self.path.open('rb') as f:
+                self.groups = pickle.load(f)
+        except (EOFError, pickle.UnpicklingError, ValueError):
+            logging.warning(f"Broken number table, ignored: {self.path.resolve()}")
+        self._stamp = stamp
+
+    def _write(self):
+        tmp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        with tmp_path.open('wb') as f:
+            pickle.dump(self.groups, f)
+        os.replace(tmp_path, self.path)
+        stat = self.path.stat()
+        self._stamp = (stat.st_mtime_ns, stat.st_size)
+
+    @contextmanager
+    def _locked(self):
+        """Hold the lock file, the table is reloaded when entering and written when leaving without error."""
+        with sharedFile.file_lock(self.path, self.lock_timeout, self.stale_lock):
+            self._reload()
+            yield
+            self._write()
+
+    def is_used(self, group, number):
+        self._reload()
+        return bool(self.groups.get(group, 0) >> number & 1)
+
+    def next_number(self, group):
+        """:return: one above the biggest used number of group, 1 if none is used"""
+        self._reload()
+        return max(self.groups.get(group, 0).bit_length(), 1)
+
+    def reserve(self, group, number):
+        """
+        Mark number as used.
+        :return: False if it is used already
+        """
+        with self._locked():
+            bitmap = self.groups.get(group, 0)
+            if bitmap >> number & 1:
+                return False
+            self.groups[group] = bitmap | 1 << number
+        return True
+
+    def allocate(self, group, limit, lowest=True):
+        """
+        Reserve the smallest free number of group, starting from 1.
+        :param limit: biggest allowed number
+        :param lowest: False to reserve the number above the biggest used one instead
+        :return: the number, None if 1 ~ limit are all used (or limit is used with lowest False)
+        """
+        with self._locked():
+            bitmap = self.groups.get(group, 0) | 1  # number 0 is never handed out
+            if lowest:
+                number = ((bitmap + 1) & ~bitmap).bit_length() - 1  # lowest clear bit
+            else:
+                number = bitmap.bit_length()
+            if number > limit:
+                return None
+            self.groups[group] = bitmap | 1 << number
+        return number
+
+    def update(self, used=(), released=()):
+        """
+        Mark and clear numbers in one write, e.g. after files were found added or removed.
+        :param used: [(group, number)]
+        :param released: [(group, number)]
+        """
+        with self._locked():
+            for group, number in used:
+                self.groups[group] = self.groups.get(group, 0) | 1 << number
+            for group, number in released:
+                bitmap = self.groups.get(group, 0) & ~(1 << number)
+                if bitmap:
+                    self.groups[group] = bitmap
+                else:
+                    self.groups.pop(group, None)
+
+    def release(self, group, number):
+        self.update(released=[(group, number)])
@@ -0,0 +1,148 @@
+from collections import OrderedDict
+from pathlib import Path
+import threading
+import logging
+import os
+
+
+class PersistenceQueue:
+    """
+    Writes files on a worker thread so saving does not block the GUI.
+    Writes are coalesced per path: when a file is submitted again before the worker reached it, only the latest
+    data is written.
+    """
+
+    def __init__(self):
+        self._pending = OrderedDict()  # {path: bytes, or None to delete the file}
+        self._before = {}  # {path: callable run right before the file is written}
+        self._failed = {}  # {path: (data, error)}
+        self._written = {}  # {path: os.stat_result} of completed writes, collected by FileIndex
+        self._writing = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='PersistenceQueue', daemon=True)
+        self._thread.start()
+
+    def submit(self, path, data, before=None):
+        """
+        :param path: file to be written
+        :param data: bytes to write, None to delete the file
+        :param before: callable run on the worker thread before the file is written, e.g. to fsync the product
+                       snapshots the data references
+        """
+        path = Path(path)
+        with self._cond:
+            self._pending[path] = data
+            if before is None:
+                self._before.pop(path, None)
+            else:
+                self._before[path] = before
+            self._failed.pop(path, None)
+            self._cond.notify()
+
+    def delete(self, path):
+        self.submit(path, None)
+
+    def pending(self, path):
+        """
+        :return: (True, data) if the path has a write that did not reach the disk yet, otherwise (False, None)
+        """
+        path = Path(path)
+        with self._cond:
+            if path in self._pending:
+                return True, self._pending[path]
+            if self._writing and self._writing[0] == path:
+                return True, self._writing[1]
+            if path in self._failed:
+                return True, self._failed[path][0]
+        return False, None
+
+    def pop_written(self, directory):
+        """
+        :param directory: only files in this directory are returned
+        :return: {path: os.stat_result} of files written since the last call
+        """
+        directory = Path(directory)
+        with self._cond:
+            written = {path: stat for path, stat in self._written.items() if path.parent == directory}
+            for path in written:
+                del self._written[path]
+        return written
+
+    def get_status(self):
+        """
+        :return: number of pending writes, [(path, error)] of failed writes
+        """
+        with self._cond:
+            return len(self._pending) + (1 if self._writing else 0), \
+                   [(path, error) for path, (_, error) in self._failed.items()]
+
+    def retry_failed(self):
+        with self._cond:
+            for path, (data, _) in self._failed.items():
+                self._pending.setdefault(path, data)
+            self._failed = {}
+            self._cond.notify()
+
+    def drain(self, timeout=None):
+        """
+        Block until every pending write is done.
+        :return: True if drained, False on timeout
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._writing, timeout)
+
+    def close(self, timeout=None):
+        self.drain(timeout)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        status = self.get_status()
+        if status[0] or status[1]:
+            logging.error(f"Close with unsaved files: {status}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                self._writing = self._pending.popitem(last=False)
+                before = self._before.get(self._writing[0])
+            path, data = self._writing
+            try:
+                if before is not None:
+                    before()
+                stat = self._write(path, data)
+            except Exception as e:  # a dead worker would leave drain() and close() waiting forever
+                logging.error(f"Save failed: {path}: {e!r}", exc_info=not isinstance(e, OSError))
+                with self._cond:
+                    self._failed[path] = (data, e)
+            else:
+                with self._cond:
+                    self._failed.pop(path, None)
+                    if path not in self._pending:
+                        self._before.pop(path, None)
+                    if stat is not None:
+                        self._written[path] = stat
+            with self._cond:
+                self._writing = None
+                self._cond.notify_all()
+
+    @staticmethod
+    def _write(path, data):
+        if data is None:
+            if path.exists():
+                logging.debug(f"Delete file: {path.resolve()}")
+                path.unlink()
+            return None
+        if not path.parent.exists():
+            path.parent.mkdir(parents=True)
+        # Unique per process and thread: other clients may be replacing the same file at the same time.
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with tmp_path.open('wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        logging.debug(f"Save file: {path.resolve()}")
+        return path.stat()
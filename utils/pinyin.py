@@ -0,0 +1,56 @@
+from functools import lru_cache
+from bisect import bisect_right
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:
+    lazy_pinyin = None
+
+# First GBK code of each initial among the level 1 GB2312 characters, which are ordered by pinyin.
+_GBK_INITIALS = [(0xB0A1, 'a'), (0xB0C5, 'b'), (0xB2C1, 'c'), (0xB4EE, 'd'), (0xB6EA, 'e'), (0xB7A2, 'f'),
+                 (0xB8C1, 'g'), (0xB9FE, 'h'), (0xBBF7, 'j'), (0xBFA6, 'k'), (0xC0AC, 'l'), (0xC2E8, 'm'),
+                 (0xC4C3, 'n'), (0xC5B6, 'o'), (0xC5BE, 'p'), (0xC6DA, 'q'), (0xC8BB, 'r'), (0xC8F6, 's'),
+                 (0xCBFA, 't'), (0xCDDA, 'w'), (0xCEF4, 'x'), (0xD1B9, 'y'), (0xD4D1, 'z')]
+_GBK_CODES = [i[0] for i in _GBK_INITIALS]
+_GBK_LEVEL1_END = 0xD7F9
+
+
+def _initial(char):
+    """Initial of a Chinese character from its GBK code, the character itself if it is not level 1."""
+    try:
+        encoded = char.encode('gbk')
+    except UnicodeEncodeError:
+        return char
+    if len(encoded) != 2:
+        return char.lower()
+    code = (encoded[0] << 8) + encoded[1]
+    if code < _GBK_CODES[0] or code > _GBK_LEVEL1_END:
+        return char
+    return _GBK_INITIALS[bisect_right(_GBK_CODES, code) - 1][1]
+
+
+def initials(text):
+    """'塑壳断路器' -> 'skdlq'"""
+    if lazy_pinyin is not None:
+        return ''.join(lazy_pinyin(text, style=Style.FIRST_LETTER)).lower()
+    return ''.join(_initial(char) for char in text)
+
+
+def spell(text):
+    """'塑壳断路器' -> 'suqueduanluqi', empty without pypinyin"""
+    if lazy_pinyin is None:
+        return ''
+    return ''.join(lazy_pinyin(text)).lower()
+
+
+@lru_cache(maxsize=1 << 16)
+def search_keys(text):
+    """
+    :return: pinyin spellings of text a keyword may match: (initials, full pinyin), only those differing from
+             text itself
+    """
+    keys = []
+    for key in (initials(text), spell(text)):
+        if key and key != text and key != text.lower() and key not in keys:
+            keys.append(key)
+    return tuple(keys)
@@ -1,38 +1,88 @@
+from utils import money
+
+
+
+
+# Product series and the model prefixes belonging to them, the prefix is the part of a model before '-'.
+product_type = {'框架断路器': ['RMW1', 'RMW2', 'ME', 'RMW3'],
+                '塑壳断路器': ['RMM1', 'RMM2', 'RMM3', 'RMM1L', 'RMM2L', 'RMM3L', 'RMM3D'],
+                '小型断路器': ['RMGQ', 'RMC3', 'RMC5', 'RMC3E'],
+                '交流接触器': ['B', 'RMK', 'CJ20', 'CJ40', 'BC', 'RMKC'],
+                '高压真空断路器': ['RMVS1', 'RMV1'],
+                '起动器': ['MSB', 'RMS1', 'RMD2', 'RMS2'],
+                '自动转换开关': ['RMQ1', 'RMQ3', 'RMQ6', 'RMQ5Y', 'RMQ6G'],
+                '其他产品': ['CA', 'CK', 'VB', 'VK', 'T联接板', 'T背包', '单供附件', 'P1700', 'NT'],
+                '热继电器': ['T'],
+                '特种电器': ['RMU1', 'RMG1', 'RMMG1', 'RMU3', 'RMKB1']}
+_SERIES = {prefix: series for series, prefixes in product_type.items() for prefix in prefixes}
+
+
+def series_of(model):
+    """:return: series (key of product_type) of a model, '' if its prefix is unknown"""
+    return _SERIES.get(model.split('-', 1)[0].strip(), '')
 
 
 class Product:
+    """
+    Immutable product. Attributes are slots and the strings and sums shown in every table row are computed
+    once, when the product is created or unpickled. Prices are also kept in integer fen (see utils.money).
+    """
+    __slots__ = ('name', 'model', 'current', 'unit', 'raw_price', 'adjunct',
+                 '_specs', '_full_model', '_adjunct_names', '_adjunct_price', '_price_fen', '_adjunct_fen', '_key',
+                 '_hash')
+
     def __init__(self, name: str , model: str, current: str, unit: str, raw_price: float, adjunct: list):
         assert type(name) == str
-        self.name = name.strip("\n\t ")
         assert type(model) == str
-        self.model = model.strip("\n\t ")
         assert type(current) == str
-        self.current = current.strip("\n\t ")
         assert type(unit) == str
-        self.unit = unit.strip("\n\t ")
         assert type(raw_price) in [int, float], f'price should be int or float, but recieve a {type(raw_price)}'
-        self.raw_price = raw_price
-        assert type(adjunct) == list, f'adjunct should be a list of tuple: [(adjunct_name, price)], but receive {type(adjunct)}'
+        assert type(adjunct) in [list, tuple], f'adjunct should be a list of tuple: [(adjunct_name, price)], but receive {type(adjunct)}'
         assert all(type(i) == tuple and len(i) == 2 for i in adjunct)
         assert all([type(i[0]) == str and (type(i[1]) == float or type(i[1]) == int) for i in adjunct])
-        self.adjunct = [(i[0].strip("\n\t "), i[1]) for i in adjunct]  # [(adjunct_name, price)]
+        self._init(name.strip("\n\t "), model.strip("\n\t "), current.strip("\n\t "), unit.strip("\n\t "),
+                   raw_price, tuple((i[0].strip("\n\t "), i[1]) for i in adjunct))  # ((adjunct_name, price))
+
+    def _init(self, name, model, current, unit, raw_price, adjunct):
+        set_attr = object.__setattr__
+        set_attr(self, 'name', name)
+        set_attr(self, 'model', model)
+        set_attr(self, 'current', current)
+        set_attr(self, 'unit', unit)
+        set_attr(self, 'raw_price', raw_price)
+        set_attr(self, 'adjunct', adjunct)
+        full_model = f'{model} {current}' if current else model
+        adjunct_names = ' '.join([i[0] for i in adjunct])
+        set_attr(self, '_full_model', full_model)
+        set_attr(self, '_adjunct_names', adjunct_names)
+        set_attr(self, '_specs', f'{full_model} {adjunct_names}' if adjunct else full_model)
+        set_attr(self, '_price_fen', money.to_fen(raw_price))
+        set_attr(self, '_adjunct_fen', sum(money.to_fen(i[1]) for i in adjunct))
+        set_attr(self, '_adjunct_price', money.to_yuan(self._adjunct_fen))
+        set_attr(self, '_key', (model, current, frozenset(i[0] for i in adjunct)))
+        set_attr(self, '_hash', hash(self._key))
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f'Product is immutable, can not set {key}')
+
+    def __getstate__(self):
+        return self.name, self.model, self.current, self.unit, self.raw_price, self.adjunct
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # Pickled before Product had slots: the state is the old __dict__ with adjunct as a list.
+            state = (state['name'], state['model'], state['current'], state['unit'], state['raw_price'],
+                     tuple(tuple(i) for i in state['adjunct']))
+        self._init(*state)
 
     def get_specs(self):
-        result = self.model
-        if self.current:
-            result += f" {self.current}"
-        if len(self.adjunct):
-            result += ' ' + ' '.join([i[0] for i in self.adjunct])
-        return result
+        return self._specs
 
     def get_model(self):
-        result = self.model
-        if self.current:
-            result += f' {self.current}'
-        return result
+        return self._full_model
 
     def get_adjunct(self):
-        return ' '.join([i[0] for i in self.adjunct])
+        return self._adjunct_names
 
     def get_name(self):
         return self.name
@@ -44,11 +94,17 @@ class Product:
         return self.raw_price
 
     def get_adjunct_price(self):
-        return float(sum([i[1] for i in self.adjunct]))
+        return self._adjunct_price
+
+    def get_raw_price_fen(self):
+        return self._price_fen
+
+    def get_adjunct_price_fen(self):
+        return self._adjunct_fen
 
     def copy(self):
-        new_adjunct = [(i[0], i[1]) for i in self.adjunct]
-        return Product(self.name, self.model, self.current, self.unit, self.raw_price, new_adjunct)
+        """Products are immutable, the product itself is returned."""
+        return self
 
     def __lt__(self, other):
         if self.model < other.model:
@@ -56,24 +112,25 @@ class Product:
         if self.model == other.model and self.current < other.current:
             return True
         if self.model == other.model and self.current == other.current and \
-                len(self.get_adjunct()) < len(other.get_adjunct()):
+                len(self._adjunct_names) < len(other._adjunct_names):
             return True
         return False
 
+    def get_key(self):
+        """Identity of a product: model, current and the set of adjunct names."""
+        return self._key
+
     def __eq__(self, other):
-        if self.model != other.model or self.current != other.current:
-            return False
-        if len(self.adjunct) != len(other.adjunct):
-            return False
-        name_list = [i[0] for i in other.adjunct]
-        for i in self.adjunct:
-            if i[0] not in name_list:
-                return False
-        return True
+        if not isinstance(other, Product):
+            return NotImplemented
+        return self._key == other._key
+
+    def __hash__(self):
+        return self._hash
 
     def __repr__(self):
         return f'Product(name = {self.name}, model = {self.model}, current = {self.current}, unit = {self.unit}, ' \
-               f'raw_price = {self.raw_price}, adjunct = {self.adjunct})'
+               f'raw_price = {self.raw_price}, adjunct = {list(self.adjunct)})'
 
 
 if __name__ == '__main__':
@@ -1,8 +1,11 @@
 import datetime
 import logging
 import pickle
+import os
 from pathlib import Path
 from utils.exception import IllegalDate, FileExceed
+from utils import archive, snapshotStore, money
+from utils.numberAllocator import NumberAllocator
 
 
 class Quote:
@@ -24,7 +27,9 @@ class Quote:
         self.qid = None
         self._modify = True
 
-        self.table = []  # [(product, quantity, discount)]
+        self.table = []  # [(product, quantity, discount, comment)]
+        self._total_amount = 0  # running totals of table, kept by the methods changing it, exact in fen
+        self._total_quantity = 0
 
     def get_comment(self):
         return self.comment if self.comment else ' '
@@ -53,6 +58,8 @@ class Quote:
     def add_item(self, product, quantity, discount, comments):
         logging.debug(f"Add line: {product}")
         self.table.append((product, quantity, discount, comments))
+        self._total_amount += money.line_amount(product, quantity, discount)
+        self._total_quantity += quantity
         # self.table.sort(key=lambda x: x[0])
         self._modify = True
 
@@ -73,21 +80,31 @@ class Quote:
 
     def del_item(self, line_number):
         logging.debug(f"Del line: {line_number}")
-        del self.table[line_number]
+        product, quantity, discount, _ = self.table.pop(line_number)
+        self._total_amount -= money.line_amount(product, quantity, discount)
+        self._total_quantity -= quantity
         self._modify = True
 
+    def set_table(self, table):
+        """:param table: [(product, quantity, discount, comment)]"""
+        self.table = table
+        self._count_totals()
+        self._modify = True
+
+    def _count_totals(self):
+        self._total_amount = sum(money.line_amount(*line[:3]) for line in self.table)
+        self._total_quantity = sum(line[1] for line in self.table)
+
     def get_total_quantity(self):
-        total = 0
-        for line in self.table:
-            total += line[1]
-        return total
+        return self._total_quantity
 
     def get_total(self):
-        total = 0
-        for line in self.table:
-            p = line[0]
-            total += line[1] * (p.get_raw_price() * line[2] + p.get_adjunct_price())
-        return total
+        """:return: yuan, exact to the fen"""
+        return money.to_yuan(self.get_total_fen())
+
+    def get_total_fen(self):
+        """:return: total of the table rounded to the fen, lines are summed unrounded"""
+        return money.round_fen(self._total_amount)
 
     def rename(self, name):
         self.name = name
@@ -109,57 +126,95 @@ class Quote:
     def get_date(self):
         return str(self.date.year), str(self.date.month), str(self.date.day)
 
-    def save(self, dir):
+    def save(self, dir, writer=None):
+        """
+        :param dir: data directory
+        :param writer: PersistenceQueue, if given the file is written in background
+        """
         p = Path(dir) / 'quote'
         if not p.exists():
             logging.debug(f"Create saving directory: {p.resolve()}")
             p.mkdir(parents=True)
 
         if not self.qid:
-            date = Quote.get_today()
-            pre_six = '{}{:0>2d}{:0>2d}'.format(str(date[0])[-2:], int(date[1]), int(date[2]))
-            pre_four = pre_six[:4]
-            biggest = 1
-            this_month = [i for i in p.iterdir() if i.stem.startswith(pre_four)]
-            for i in this_month:
-                number = int(i.stem[-4:-1])
-                if number >= biggest:
-                    biggest = number + 1
-            if biggest > 999:
-                raise FileExceed(f'Contracts for this month {pre_six} exceed 100.')
-            last_four = '{:0>3d}2'.format(biggest)
-            self.qid = pre_six + last_four
+            numbers = NumberAllocator(Path(dir) / 'quote_numbers.data')
+            if not numbers.exists():
+                numbers.update(used=[qid_number(i.stem) for i in p.iterdir() if i.suffix == '.data'])
+            self.qid = Quote.allocate_qid(numbers)
 
         p = p / f'{self.qid}.data'
         if self._modify:
             self._modify = False
+            store_path = Path(dir) / 'snapshots.data'
+            state = snapshotStore.dump_state(self.__dict__, store_path)
+            sync = snapshotStore.open_store(store_path).sync  # the snapshots reach the disk first
+            if writer:
+                logging.debug(f"Queue quote: {p.resolve()}")
+                writer.submit(p, pickle.dumps(state), before=sync)
+                return
             logging.debug(f"Save quote: {p.resolve()}")
-            with p.open('wb') as f:
-                pickle.dump(self.__dict__, f)
+            sync()
+            tmp_path = p.with_suffix('.tmp')
+            with tmp_path.open('wb') as f:
+                pickle.dump(state, f)
+            os.replace(tmp_path, p)
         else:
             logging.debug(f"Quote no modify, did not save: {p.resolve()}")
 
-    def delete(self, dir):
+    def delete(self, dir, writer=None):
         qid = self.qid
         p = Path(dir) / 'quote' / f'{qid}.data'
-        if p.exists():
+        if writer:
+            writer.delete(p)
+        elif p.exists():
             logging.debug(f"Delete quote: {p.resolve()}")
             p.unlink()
+        archive.remove_packed(p.parent, qid)
 
     def get_name(self):
         return self.name if self.name else self.qid
 
     @staticmethod
-    def load(qid, data_dir):
+    def load(qid, data_dir, writer=None):
+        """
+        :param writer: PersistenceQueue, a write still waiting in it is returned instead of the file
+        A quote without a loose file is read from the year pack.
+        """
         q = Quote()
         p = Path(data_dir) / 'quote' / f'{qid}.data'
-        assert p.exists()
-        with p.open('rb') as pkl_file:
-            q.__dict__ = pickle.load(pkl_file)
-        logging.debug(f"Load quote from file: {p.resolve()}")
+        store_path = Path(data_dir) / 'snapshots.data'
+        queued, data = writer.pending(p) if writer else (False, None)
+        if queued:
+            assert data is not None, f"File deleted: {p}"
+            q.__dict__ = snapshotStore.load_state(pickle.loads(data), store_path)
+            logging.debug(f"Load queued quote: {p.resolve()}")
+        elif p.exists():
+            with p.open('rb') as pkl_file:
+                q.__dict__ = snapshotStore.load_state(pickle.load(pkl_file), store_path)
+            logging.debug(f"Load quote from file: {p.resolve()}")
+        else:
+            data = archive.read_packed(p.parent, qid)
+            assert data is not None, f"No existing file: {p}"
+            q.__dict__ = snapshotStore.load_state(pickle.loads(data), store_path)
+            logging.debug(f"Load quote from pack: {archive.pack_path(p.parent, qid).resolve()}")
+        if '_total_amount' not in q.__dict__:
+            q._count_totals()  # saved before the exact running total was kept
         q._modify = False
         return q
 
+    @staticmethod
+    def allocate_qid(numbers):
+        """
+        :param numbers: NumberAllocator of quote numbers, the new number is reserved in it
+        :return: next qid of this month: yymmdd + 3 digits sequence above the month's biggest + '2'
+        """
+        date = Quote.get_today()
+        pre_six = '{}{:0>2d}{:0>2d}'.format(str(date[0])[-2:], int(date[1]), int(date[2]))
+        number = numbers.allocate(pre_six[:4], 999, lowest=False)
+        if number is None:
+            raise FileExceed(f'Quotes for this month {pre_six} exceed 999.')
+        return pre_six + '{:0>3d}2'.format(number)
+
     @staticmethod
     def get_today():
         """ Get today's date: (year, month, day)"""
@@ -167,8 +222,12 @@ class Quote:
         return str(today.year), str(today.month), str(today.day)
 
 
+def qid_number(qid):
+    """Group and sequence number of a qid in the number table: ('yymm', 3 digits sequence)."""
+    return qid[:4], int(qid[6:9])
+
+
 if __name__ == '__main__':
-    import os
     os.chdir('../')
     q = Quote()
     # q.save('data')
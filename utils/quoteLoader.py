@@ -1,5 +1,11 @@
 from utils.excel import Excel
-from utils.quote import Quote
+from utils.quote import Quote, qid_number
+from utils.fileIndex import FileIndex
+from utils.persistence import PersistenceQueue
+from utils import money
+from utils.textIndex import TextIndex
+from utils.usageIndex import UsageIndex
+from utils.numberAllocator import NumberAllocator
 from pathlib import Path
 from collections import defaultdict
 import re
@@ -7,28 +13,96 @@ import datetime
 import logging
 
 
+def _quote_header(q):
+    """Manifest entry of a quote, used by the quote tree and the search without unpickling the quote."""
+    return {'name': q.get_name(), 'date': q.get_date(), 'total_fen': q.get_total_fen(), 'buyer': q.buyer_name,
+            'text': _quote_text(q), 'products': tuple(line[0].get_key() for line in q.table)}
+
+
+def _quote_text(q):
+    """Texts of a quote the full-text search looks at besides its name and buyer."""
+    texts = (q.qid, q.project_name, q.buyer_contact, q.buyer_tel, q.quote_contact, q.quote_tel, q.qq, q.comment,
+             *(line[3] for line in q.table))
+    return tuple(text for text in texts if text and isinstance(text, str))
+
+
+def _text_fields(header):
+    return ((3, header['name']), (3, header['buyer'])) + tuple((1, i) for i in header['text'])
+
+
 class QuoteLoader:
-    def __init__(self, data_dir='data'):
-        self.quotes = {}
+    def __init__(self, data_dir='data', capacity=32):
+        """
+        :param data_dir: directory containing the quote directory
+        :param capacity: number of full quotes kept in memory, the rest only keep their manifest entry
+        """
         self.data_dir = data_dir
+        self.writer = PersistenceQueue()
+        self.quotes = FileIndex(Path(data_dir) / 'quote', Path(data_dir) / 'quote_index.data',
+                                self._load_quote, _quote_header, capacity=capacity, version=5, writer=self.writer)
+        self.text_index = None  # TextIndex of quotes, loaded on the first search()
+        self.text_index_path = Path(data_dir) / 'quote_text.data'
+        self.usage_index = UsageIndex()  # product key -> lines of quotes using it
+        self.usage_index.rebuild((qid, header['products']) for qid, header in self.quotes.headers.items())
+        self.quotes.observers.append(self._header_changed)
+        self.numbers = NumberAllocator(Path(data_dir) / 'quote_numbers.data')  # used sequence numbers per month
+        self.refresh(force=False)
+
+    def _load_quote(self, qid):
+        return Quote.load(qid, self.data_dir, self.writer)
+
+    def _header_changed(self, qid, header):
+        if header is None:
+            self.usage_index.remove(qid)
+        else:
+            self.usage_index.set(qid, header['products'])
+        if self.text_index is None:
+            return
+        if header is None:
+            self.text_index.remove(qid)
+        else:
+            self.text_index.add(qid, header)
+
+    def search(self, keyword, limit=100):
+        """
+        Full-text search of quotes of every year: name, project, buyer, contacts, phone and QQ numbers, comment
+        and line comments. Every word of keyword must appear.
+        :param limit: number of results, all if None
+        :return: [(qid, quote's name)], most relevant first
+        """
+        if self.text_index is None:
+            self.text_index = TextIndex.load(self.text_index_path, _text_fields)
+            self.text_index.sync(self.quotes.headers)
+        return [(qid, self.quotes.header(qid)['name']) for qid, _ in self.text_index.search(keyword, limit)]
 
-        # load quotes
-        quotes_path = Path(self.data_dir) / 'quote'
+    def where_used(self, product):
+        """
+        :param product: Product
+        :return: [(qid, quote's name, [line number])] of quotes containing the product, newest first, line numbers
+                 start from 1
+        """
+        return [(qid, self.quotes.header(qid)['name'], [i + 1 for i in lines])
+                for qid, lines in self.usage_index.where_used(product.get_key())]
 
-        if quotes_path.exists():
-            for f in quotes_path.iterdir():
-                qid = f.stem
-                if f.suffix == '.data':
-                    self.quotes[qid] = Quote.load(qid, self.data_dir)
+    def _table_changed(self, qid):
+        if qid in self.quotes:
+            self.usage_index.set(qid, (line[0].get_key() for line in self.quotes[qid].get_table()))
 
-    def refresh(self):
-        self.quotes = {}
-        quotes_path = Path(self.data_dir) / 'quote'
-        if quotes_path.exists():
-            for f in quotes_path.iterdir():
-                qid = f.stem
-                if f.suffix == '.data':
-                    self.quotes[qid] = Quote.load(qid, self.data_dir)
+    def refresh(self, force=True):
+        """
+        Refresh from file. Files are compared with the last known (mtime, size), only added or changed files
+        are loaded again and deleted ones are dropped.
+        :param force: stat every file even if the directory mtime did not change
+        :return: {'added': [qid], 'changed': [qid], 'removed': [qid]}
+        """
+        added, changed, removed = self.quotes.scan(force)
+        if not self.numbers.exists():
+            self.numbers.update(used=[qid_number(qid) for qid in self.quotes])
+        elif added or removed:
+            # files created or deleted by another client, or by hand
+            self.numbers.update(used=[qid_number(qid) for qid in added], released=[qid_number(qid) for qid in removed])
+        logging.info(f"Refresh quoteloader: {len(added)} added, {len(changed)} changed, {len(removed)} removed.")
+        return {'added': added, 'changed': changed, 'removed': removed}
 
     def export_excel(self, qid, output_type, file_dir):
         """
@@ -39,7 +113,8 @@ class QuoteLoader:
         """
         e = Excel(self.quotes[qid])
         e.run(output_type=2, file_dir=file_dir)
-        self.quotes[qid].save(self.data_dir)
+        self.quotes[qid].save(self.data_dir, self.writer)
+        self.quotes.update(qid)
 
     def save(self, qid):
         """
@@ -47,7 +122,8 @@ class QuoteLoader:
         :param qid: Quote to be saved
         :return: None
         """
-        self.quotes[qid].save(self.data_dir)
+        self.quotes[qid].save(self.data_dir, self.writer)
+        self.quotes.update(qid)
 
     def add_product(self, qid, product, quantity: str, discount: str, comments: str):
         """
@@ -70,6 +146,7 @@ class QuoteLoader:
         if not discount:
             discount = 1
         self.quotes[qid].add_item(product, int(quantity), float(discount), comments)
+        self._table_changed(qid)
         return 0
 
     def move_product(self, qid, start_line, destination_line):
@@ -81,6 +158,7 @@ class QuoteLoader:
         :return:
         """
         self.quotes[qid].move_product(start_line, destination_line)
+        self._table_changed(qid)
 
     def sort_products(self, qid):
         """
@@ -89,6 +167,7 @@ class QuoteLoader:
         :return:
         """
         self.quotes[qid].table_sort()
+        self._table_changed(qid)
 
     def remove_product(self, qid, line_number):
         """
@@ -97,6 +176,7 @@ class QuoteLoader:
         :return: None
         """
         self.quotes[qid].del_item(line_number)
+        self._table_changed(qid)
 
     def get_table(self, qid):
         return self.quotes[qid].get_table()
@@ -109,11 +189,10 @@ class QuoteLoader:
         """
         result = []
         for i, (product, quantity, discount, comment) in enumerate(self.quotes[qid].get_table()):
-            single_price = product.get_raw_price() * discount + product.get_adjunct_price()
-            total_price = single_price * quantity
+            single_price = money.unit_price(product.get_raw_price_fen(), discount, product.get_adjunct_price_fen())
             result.append((i + 1, product.get_name(), product.get_specs(), product.get_unit(), str(quantity),
                            product.get_raw_price(), str(discount), str(product.get_adjunct_price()),
-                           str(single_price), str(total_price), comment))
+                           money.format_price(single_price), money.format_price(single_price * quantity), comment))
         return result
 
     def get_table_total(self, qid):
@@ -130,13 +209,13 @@ class QuoteLoader:
         :return: dictionary
         """
         tree = defaultdict(dict)
-        for i, q in self.quotes.items():
+        for i in self.quotes:
             year = f'20{i[:2]}'
             month = i[2:4]
             if month in tree[year]:
-                tree[year][month].append((q.get_qid(), q.get_name()))
+                tree[year][month].append((i, self.quotes.header(i)['name']))
             else:
-                tree[year][month] = [(q.get_qid(), q.get_name())]
+                tree[year][month] = [(i, self.quotes.header(i)['name'])]
         return tree
 
     def get_quote_list(self, date):
@@ -151,7 +230,7 @@ class QuoteLoader:
         elif not month:
             return sorted({('00000000', f'{i[2:4]}') for i in self.quotes if i[:2] == year[-2:]}, key=lambda x: x[1])
         else:
-            return [(i, v.get_name()) for i, v in self.quotes.items()
+            return [(i, self.quotes.header(i)['name']) for i in self.quotes
                     if i[:2] == year[-2:] and i[2:4] == '{:0>2d}'.format(int(month))]
 
     def create_quote(self, project_name, date, buyer_name, buyer_contact, buyer_tel,
@@ -172,7 +251,12 @@ class QuoteLoader:
         q = Quote(project_name=project_name, date=date, buyer_name=buyer_name, buyer_contact=buyer_contact,
                   buyer_tel=buyer_tel, quote_contact=quote_contact, quote_tel=quote_tel, qq=qq, name=name,
                   comment=comment)
-        q.save(self.data_dir)
+        q.qid = Quote.allocate_qid(self.numbers)
+        try:
+            q.save(self.data_dir, self.writer)
+        except Exception:
+            self.numbers.release(*qid_number(q.qid))
+            raise
         qid = q.get_qid()
         self.quotes[qid] = q
         logging.info(f"Create contract: {qid}")
@@ -204,7 +288,8 @@ class QuoteLoader:
             q.quote_tel = quote_tel
             q.qq = qq
             q.comment = comment
-            q.save(self.data_dir)
+            q.save(self.data_dir, self.writer)
+            self.quotes.update(qid)
 
     def get(self, qid):
         """
@@ -224,15 +309,49 @@ class QuoteLoader:
         """
         if qid in self.quotes:
             self.quotes[qid].rename(name)
-            self.quotes[qid].save(self.data_dir)
+            self.quotes[qid].save(self.data_dir, self.writer)
+            self.quotes.update(qid)
 
     def delete(self, qid):
         """
         :param qid:
         :return:
         """
-        self.quotes[qid].delete(self.data_dir)
+        self.quotes[qid].delete(self.data_dir, self.writer)
         del self.quotes[qid]
+        self.numbers.release(*qid_number(qid))
+
+    def archive_year(self, year):
+        """
+        Pack every quote of a closed year into data/quote/<year>.pack. Archived quotes stay readable and
+        editable, an edited quote is saved as a loose file again.
+        :param year: str, e.g. '2021'
+        :return: number of archived quotes
+        """
+        if int(year) >= datetime.date.today().year:
+            raise ValueError(f'Year {year} is not closed yet.')
+        self.writer.drain()
+        self.quotes.scan(force=True)
+        count = self.quotes.archive([qid for qid in self.quotes if qid[:2] == str(year)[-2:]])
+        logging.info(f"Archive {count} quote(s) of {year}")
+        return count
+
+    def get_save_status(self):
+        """
+        :return: number of files waiting to be written, [(path, error)] of failed writes
+        """
+        return self.writer.get_status()
+
+    def retry_failed_saves(self):
+        self.writer.retry_failed()
+
+    def close(self):
+        """Write everything still queued, called when the application exits."""
+        self.writer.drain()
+        self.quotes.save_index()
+        if self.text_index is not None and self.text_index.changed:
+            self.writer.submit(self.text_index_path, self.text_index.dumps())
+        self.writer.close()
 
     @staticmethod
     def get_today():
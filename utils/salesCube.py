@@ -0,0 +1,84 @@
+from utils import money
+
+
+def _new_cell():
+    return {'count': 0, 'total_fen': 0, 'quantity': 0, 'brands': {}, 'buyers': {}}
+
+
+def _add_group(groups, name, total_fen, sign):
+    """groups: {name: [count, total_fen]}, entries whose count drops to 0 are removed"""
+    group = groups.setdefault(name, [0, 0])
+    group[0] += sign
+    group[1] += sign * total_fen
+    if not group[0]:
+        del groups[name]
+
+
+class SalesCube:
+    """
+    Sales aggregated by period (all, year, month): number of contracts, total amount in fen, total quantity and
+    the amount per brand and per buyer. Kept up to date from contract headers, so a period's statistics are a
+    dictionary lookup instead of a walk over the contracts.
+    """
+
+    def __init__(self):
+        self.cells = {(None, None): _new_cell()}  # {(year 'yyyy' or None, month 'mm' or None): cell}
+        self.rows = {}  # {cid: (periods, total_fen, quantity, brand, buyer)} as counted
+
+    @staticmethod
+    def _periods(cid):
+        year = f'20{cid[:2]}'
+        return (None, None), (year, None), (year, cid[2:4])
+
+    @staticmethod
+    def _period(year, month):
+        if not year:
+            return None, None
+        return f'20{str(year)[-2:]}', '{:0>2d}'.format(int(month)) if month else None
+
+    def _apply(self, row, sign):
+        periods, total_fen, quantity, brand, buyer = row
+        for period in periods:
+            cell = self.cells.get(period)
+            if cell is None:
+                cell = self.cells[period] = _new_cell()
+            cell['count'] += sign
+            cell['total_fen'] += sign * total_fen
+            cell['quantity'] += sign * quantity
+            _add_group(cell['brands'], brand, total_fen, sign)
+            _add_group(cell['buyers'], buyer, total_fen, sign)
+            if not cell['count'] and period != (None, None):
+                del self.cells[period]
+
+    def set(self, cid, header):
+        """Count (again) the contract cid, header None removes it."""
+        row = self.rows.pop(cid, None)
+        if row is not None:
+            self._apply(row, -1)
+        if header is not None:
+            row = (self._periods(cid), header['total_fen'], header['quantity'], header['brand'], header['buyer'])
+            self.rows[cid] = row
+            self._apply(row, 1)
+
+    def rebuild(self, headers):
+        """:param headers: {cid: header}"""
+        self.cells = {(None, None): _new_cell()}
+        self.rows = {}
+        for cid, header in headers.items():
+            self.set(cid, header)
+
+    def get(self, year=None, month=None):
+        """
+        :param year: 'yyyy' (or 'yy'), None for all years
+        :param month: month of year, None for the whole year
+        :return: {'count', 'total', 'quantity', 'brands': {brand: total}, 'buyers': {buyer: total}}, totals in yuan
+        """
+        cell = self.cells.get(self._period(year, month)) or _new_cell()
+        return {'count': cell['count'], 'total': money.to_yuan(cell['total_fen']), 'quantity': cell['quantity'],
+                'brands': {name: money.to_yuan(group[1]) for name, group in cell['brands'].items()},
+                'buyers': {name: money.to_yuan(group[1]) for name, group in cell['buyers'].items()}}
+
+    def get_total(self, year=None, month=None):
+        """:return: (total in yuan, number of contracts) of the period, without copying the groups"""
+        cell = self.cells.get(self._period(year, month)) or _new_cell()
+        return money.to_yuan(cell['total_fen']), cell['count']
@@ -0,0 +1,88 @@
+from collections import defaultdict
+from utils import pinyin
+
+
+def search_fields(product):
+    """
+    Texts a keyword is matched against: model with current, name, every adjunct name and the pinyin
+    initials (full pinyin with pypinyin installed) of name and adjunct names.
+    """
+    fields = (product.get_model(), product.get_name()) + tuple(i[0] for i in product.adjunct)
+    for text in fields[1:]:
+        fields += pinyin.search_keys(text)
+    return fields
+
+
+def matches(product, keyword):
+    return any(keyword in field for field in search_fields(product))
+
+
+def _grams(text):
+    """Characters and character bigrams of text."""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+class SearchIndex:
+    """
+    Inverted index of character unigrams and bigrams over the search fields of items (products by default).
+    A keyword is looked up by intersecting the posting sets of its bigrams (of its character when it is a
+    single character); the few candidates left are then checked with a substring test.
+    """
+
+    def __init__(self, fields_func=search_fields):
+        """
+        :param fields_func: item -> tuple of texts to be searched
+        """
+        self.fields_func = fields_func
+        self.postings = defaultdict(set)  # {gram: {key}}
+        self.fields = {}  # {key: search fields}
+
+    def add(self, key, item):
+        fields = self.fields_func(item)
+        self.fields[key] = fields
+        for field in fields:
+            for gram in _grams(field):
+                self.postings[gram].add(key)
+
+    def remove(self, key):
+        fields = self.fields.pop(key, None)
+        if fields is None:
+            return
+        for field in fields:
+            for gram in _grams(field):
+                posting = self.postings.get(gram)
+                if posting is not None:
+                    posting.discard(key)
+                    if not posting:
+                        del self.postings[gram]
+
+    def rebuild(self, items):
+        """:param items: {key: item}, e.g. {pid: Product}"""
+        self.postings = defaultdict(set)
+        self.fields = {}
+        for key, item in items.items():
+            self.add(key, item)
+
+    def search(self, keyword):
+        """
+        :return: {key} of items having keyword in one of their search fields
+        """
+        if not keyword:
+            return set(self.fields)
+        if len(keyword) == 1:
+            return set(self.postings.get(keyword, ()))
+        grams = [keyword[i:i + 2] for i in range(len(keyword) - 1)]
+        postings = sorted((self.postings.get(gram, set()) for gram in set(grams)), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates &= posting
+        if len(keyword) == 2:
+            return candidates
+        return {key for key in candidates if any(keyword in field for field in self.fields[key])}
+
+    def __len__(self):
+        return len(self.fields)
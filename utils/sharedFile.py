@@ -0,0 +1,158 @@
+from contextlib import contextmanager
+from pathlib import Path
+from utils.exception import FileOccupied
+import logging
+import pickle
+import io
+import struct
+import time
+import zlib
+import os
+
+# Frame of a record in an append only file: magic, length and crc32 of the pickled payload. A reader skips a
+# torn record (a crashed writer) by looking for the next frame whose checksum matches.
+MAGIC = b'\xa5Z'
+_HEADER = struct.Struct('<2sII')
+
+
+@contextmanager
+def file_lock(path, timeout=5, stale=30):
+    """
+    Hold <path>.lock, created exclusively, so clients sharing the data directory change path one at a time.
+    :param timeout: seconds waited for another client's lock
+    :param stale: seconds after which a lock is considered left by a crashed client and removed
+    :raise FileOccupied: if the lock is not free within timeout
+    """
+    path = Path(path)
+    lock_path = path.with_name(path.name + '.lock')
+    lock_path.parent.mkdir(parents=True, exist_ok=True)  # first start, the data directory does not exist yet
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - lock_path.stat().st_mtime > stale:
+                    logging.warning(f"Remove stale lock: {lock_path.resolve()}")
+                    lock_path.unlink()
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > deadline:
+                raise FileOccupied(f'File is locked: {lock_path.resolve()}')
+            time.sleep(0.02)
+    try:
+        os.close(fd)
+        yield
+    finally:
+        lock_path.unlink()
+
+
+def dump_record(obj):
+    """:return: framed bytes of obj, to be appended to a file read with read_records"""
+    payload = pickle.dumps(obj, protocol=4)
+    return _HEADER.pack(MAGIC, len(payload), zlib.crc32(payload)) + payload
+
+
+def _parse(data, pos):
+    """
+    :return: ('ok', record, end), ('skip', None, end) for a sound frame that can not be unpickled,
+             ('incomplete', None, None) or ('broken', None, None)
+    """
+    if len(data) - pos < _HEADER.size:
+        return 'incomplete' if MAGIC.startswith(data[pos:pos + 2]) else 'broken', None, None
+    magic, length, crc = _HEADER.unpack_from(data, pos)
+    if magic != MAGIC:
+        return 'broken', None, None
+    start = pos + _HEADER.size
+    end = start + length
+    if end > len(data):
+        return 'incomplete', None, None
+    payload = data[start:end]
+    if zlib.crc32(payload) != crc:
+        return 'broken', None, None
+    try:
+        return 'ok', pickle.loads(payload), end
+    except Exception as e:
+        logging.warning(f"Skip record that can not be read: {e!r}")
+        return 'skip', None, end
+
+
+def _resync(data, pos):
+    """:return: position of the next complete sound frame at or after pos, None if there is none"""
+    pos = data.find(MAGIC, pos)
+    while pos != -1:
+        if _parse(data, pos)[0] in ('ok', 'skip'):
+            return pos
+        pos = data.find(MAGIC, pos + 1)
+    return None
+
+
+def is_framed(path):
+    """False if path holds records written before framing (plain consecutive pickles)."""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(len(MAGIC))
+    except FileNotFoundError:
+        return True
+    return not head or head == MAGIC
+
+
+def _read_legacy(data, offset):
+    """Records written before framing: consecutive pickles, read up to the first one that fails."""
+    records = []
+    f = io.BytesIO(data)
+    pos = 0
+    while pos < len(data):
+        try:
+            records.append(pickle.load(f))
+        except Exception:
+            break
+        pos = f.tell()
+    return records, offset + pos
+
+
+def read_records(path, offset=0):
+    """
+    Read the records of path starting at offset. Broken bytes between records are skipped, a record that is
+    not complete at the end of the file (being written, or left by a crashed writer) is left for the next read.
+    A file written before framing is read as plain consecutive pickles.
+    :return: [record], offset after the last record read
+    """
+    try:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return [], offset
+    if offset == 0 and data and not data.startswith(MAGIC):
+        return _read_legacy(data, offset)
+    records = []
+    pos = 0
+    while pos < len(data):
+        status, record, end = _parse(data, pos)
+        if status == 'ok':
+            records.append(record)
+        if end is None:
+            end = _resync(data, pos + 1)
+            if end is None:
+                break
+            logging.warning(f"Skip {end - pos} broken byte(s) at {offset + pos}: {Path(path).resolve()}")
+        pos = end
+    return records, offset + pos
+
+
+def read_first(path):
+    """:return: first record of path, None if there is none"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read(_HEADER.size)
+            if not data.startswith(MAGIC):
+                f.seek(0)
+                return pickle.load(f)
+            if len(data) == _HEADER.size:
+                data += f.read(_HEADER.unpack(data)[1])
+    except Exception:  # missing, empty or torn file
+        return None
+    return _parse(data, 0)[1]
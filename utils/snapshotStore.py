@@ -0,0 +1,137 @@
+from utils.product import Product
+from utils import sharedFile
+from pathlib import Path
+import threading
+import hashlib
+import logging
+import pickle
+import os
+
+_stores = {}  # {path: SnapshotStore}
+
+
+class SnapshotStore:
+    """
+    Content addressed store of product snapshots shared by all contracts and quotes.
+    Table lines reference a product by the digest of its state, so a product used in many tables is stored
+    once, and a table keeps the price it was made with even after the catalog changes.
+    The file is append only: a sequence of framed (digest, product state) records.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.products = {}  # {digest: Product}
+        self._offset = 0
+        self._unsynced = False  # records appended but not fsynced yet
+        self._lock = threading.Lock()
+        self._read_tail()
+
+    @staticmethod
+    def digest(product):
+        return hashlib.blake2b(pickle.dumps(product.__getstate__(), protocol=4), digest_size=16).hexdigest()
+
+    def _read_tail(self, offset=None):
+        """Read records appended (also by other clients) since the last read, or since offset."""
+        records, self._offset = sharedFile.read_records(self.path, self._offset if offset is None else offset)
+        for digest, state in records:
+            if digest not in self.products:
+                p = Product.__new__(Product)
+                p.__setstate__(state)
+                self.products[digest] = p
+
+    def put(self, products):
+        """
+        Store the snapshots not stored yet. Records are framed (see utils.sharedFile) and appended under a lock
+        file, so clients sharing the store do not interleave them and a record torn by a crash is skipped.
+        The file is not fsynced here: call sync() before writing a table referencing the snapshots, the
+        persistence queue does it on its worker thread.
+        :param products: [Product]
+        :return: [digest]
+        """
+        digests = [self.digest(product) for product in products]
+        with self._lock:
+            new = {digest: product for digest, product in zip(digests, products) if digest not in self.products}
+            if new:
+                with sharedFile.file_lock(self.path):
+                    if not sharedFile.is_framed(self.path):
+                        self._convert()
+                    self._read_tail()
+                    data = b''.join(sharedFile.dump_record((digest, product.__getstate__()))
+                                    for digest, product in new.items() if digest not in self.products)
+                    with self.path.open('ab') as f:
+                        end = f.tell()
+                        f.write(data)
+                        if end == self._offset:  # nothing unread before our records, e.g. a torn one
+                            self._offset = f.tell()
+                self.products.update(new)
+                self._unsynced = True
+                logging.debug(f"Store {len(new)} product snapshot(s): {self.path.resolve()}")
+        return digests
+
+    def _convert(self):
+        """Rewrite a store written before framing, the lock file is held by the caller."""
+        self._read_tail(0)
+        tmp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        with tmp_path.open('wb') as f:
+            for digest, product in self.products.items():
+                f.write(sharedFile.dump_record((digest, product.__getstate__())))
+            self._offset = f.tell()
+        os.replace(tmp_path, self.path)
+        logging.info(f"Convert product snapshots to framed records: {self.path.resolve()}")
+
+    def sync(self):
+        """fsync the records appended by put(), so tables written afterwards never reference a lost snapshot."""
+        with self._lock:
+            if not self._unsynced:
+                return
+            self._unsynced = False
+            with self.path.open('ab') as f:
+                os.fsync(f.fileno())
+
+    def get(self, digest):
+        with self._lock:
+            if digest not in self.products:
+                self._read_tail()
+            if digest not in self.products:
+                self._read_tail(0)  # the file was rewritten (converted) by another client
+            return self.products[digest]
+
+    def dump_table(self, table):
+        """
+        :param table: [(Product, quantity, discount, comment)]
+        :return: [(digest, quantity, discount, comment)]
+        """
+        digests = self.put([line[0] for line in table])
+        return [(digest,) + tuple(line[1:]) for digest, line in zip(digests, table)]
+
+    def load_table(self, lines):
+        """
+        :param lines: [(digest, quantity, discount, comment)]
+        :return: [(Product, quantity, discount, comment)]
+        """
+        return [(self.get(line[0]),) + tuple(line[1:]) for line in lines]
+
+
+def open_store(path):
+    """:return: the SnapshotStore of path, one instance per file"""
+    path = Path(path)
+    if path not in _stores:
+        _stores[path] = SnapshotStore(path)
+    return _stores[path]
+
+
+def dump_state(state, path):
+    """
+    :param state: __dict__ of a Contract or Quote
+    :return: copy of state whose table references the snapshots in the store at path
+    """
+    state = dict(state)
+    state['table_refs'] = open_store(path).dump_table(state.pop('table'))
+    return state
+
+
+def load_state(state, path):
+    """Inverse of dump_state, a state saved with embedded products is returned as it is."""
+    if 'table_refs' in state:
+        state['table'] = open_store(path).load_table(state.pop('table_refs'))
+    return state
@@ -0,0 +1,41 @@
+from bisect import bisect_left, insort
+
+
+class SortedView:
+    """
+    Pids kept sorted by (key_func(product), pid), maintained with bisect on every add and remove, so ordered
+    listings never sort the whole catalog.
+    """
+
+    def __init__(self, key_func):
+        """
+        :param key_func: Product -> sort key
+        """
+        self.key_func = key_func
+        self.entries = []  # [(key, pid)] sorted
+
+    def add(self, pid, product):
+        insort(self.entries, (self.key_func(product), pid))
+
+    def remove(self, pid, product):
+        entry = (self.key_func(product), pid)
+        i = bisect_left(self.entries, entry)
+        if i < len(self.entries) and self.entries[i] == entry:
+            del self.entries[i]
+
+    def rebuild(self, products):
+        """:param products: {pid: Product}"""
+        self.entries = sorted((self.key_func(product), pid) for pid, product in products.items())
+
+    def pids(self):
+        return [pid for _, pid in self.entries]
+
+    def order(self, pids, products):
+        """
+        :param pids: subset of the view's pids
+        :param products: {pid: Product}
+        :return: pids in the view's order; small subsets are sorted, large ones are filtered from the view
+        """
+        if len(pids) * 16 < len(self.entries):
+            return sorted(pids, key=lambda pid: (self.key_func(products[pid]), pid))
+        return [pid for _, pid in self.entries if pid in pids]
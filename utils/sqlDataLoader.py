@@ -0,0 +1,183 @@
+from utils.exception import ProductNotExist, ProductAlreadyExist
+from utils.dataLoader import DataLoader
+from utils.bkTree import BKTree
+from utils.product import Product
+from utils import pinyin
+from pathlib import Path
+import sqlite3
+import json
+import logging
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS products (
+    pid INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    model TEXT NOT NULL,
+    current TEXT NOT NULL,
+    unit TEXT NOT NULL,
+    raw_price REAL NOT NULL,
+    adjunct TEXT NOT NULL,
+    adjunct_key TEXT NOT NULL,
+    full_model TEXT NOT NULL,
+    pinyin TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS products_name ON products (name);
+CREATE INDEX IF NOT EXISTS products_model ON products (model);
+CREATE INDEX IF NOT EXISTS products_current ON products (current);
+CREATE INDEX IF NOT EXISTS products_full_model ON products (full_model);
+CREATE UNIQUE INDEX IF NOT EXISTS products_identity ON products (model, current, adjunct_key);
+'''
+
+
+def _adjunct_key(product):
+    """Normalized adjunct names: two products are equal when model, current and adjunct names match."""
+    return '\x1f'.join(sorted(i[0] for i in product.adjunct))
+
+
+def _pinyin(product):
+    """Pinyin spellings of name and adjunct names, searched together with the model."""
+    keys = pinyin.search_keys(product.name)
+    for i in product.adjunct:
+        keys += pinyin.search_keys(i[0])
+    return '\x1f'.join(keys)
+
+
+def _to_product(row):
+    name, model, current, unit, raw_price, adjunct = row
+    return Product(name, model, current, unit, raw_price, [tuple(i) for i in json.loads(adjunct)])
+
+
+class SqlDataLoader:
+    """
+    DataLoader backed by data/products.db (sqlite3). Every change is committed at once, so the database file
+    itself is the shared copy and no merge is needed in save().
+    """
+
+    def __init__(self, data_dir='data'):
+        p = Path(data_dir)
+        if not p.exists():
+            logging.info(f"Create data directory: {p.resolve()}")
+            p.mkdir(parents=True)
+        self.data_dir = data_dir
+        self.db_path = p / 'products.db'
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.executescript(_SCHEMA)
+        self._data_version = self._get_data_version()
+        self._fuzzy_index = None  # BKTree of upper case full_model, built on the first fuzzy search
+        self.revision = 0  # bumped on every catalog change, see DataLoader.revision
+
+    def _get_data_version(self):
+        """Changes whenever another connection commits to the database."""
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def refresh(self, data_dir='data'):
+        """
+        :return: True if other clients changed the catalog since the last refresh
+        """
+        self.save(data_dir)
+        data_version = self._get_data_version()
+        changed = data_version != self._data_version
+        self._data_version = data_version
+        if changed:
+            self._fuzzy_index = None
+            self.revision += 1
+        logging.info("Refresh sqldataloader.")
+        return changed
+
+    def get_product(self, pid):
+        row = self.conn.execute('SELECT name, model, current, unit, raw_price, adjunct FROM products WHERE pid = ?',
+                                (pid,)).fetchone()
+        if row is None:
+            logging.info(f"Product id not exist: {pid}")
+            raise ProductNotExist(f"Product id not exist: {pid}")
+        return _to_product(row)
+
+    def get_products_list(self, key='model'):
+        """Same order as DataLoader.get_products_list"""
+        order = 'full_model, pid' if key == 'model' else 'name, model, pid'
+        rows = self.conn.execute('SELECT pid, name, model, current, unit, raw_price, adjunct FROM products '
+                                 f'ORDER BY {order}')
+        return [(row[0], _to_product(row[1:])) for row in rows]
+
+    def add_data(self, new_product, pid=None):
+        try:
+            with self.conn:
+                cursor = self.conn.execute(
+                    'INSERT INTO products (pid, name, model, current, unit, raw_price, adjunct, adjunct_key, '
+                    'full_model, pinyin) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (pid, new_product.name, new_product.model, new_product.current, new_product.unit,
+                     new_product.raw_price, json.dumps(new_product.adjunct, ensure_ascii=False),
+                     _adjunct_key(new_product), new_product.get_model(), _pinyin(new_product)))
+        except sqlite3.IntegrityError:
+            logging.info(f'Product already exists: {new_product}')
+            raise ProductAlreadyExist(f'Product already exists: {new_product}')
+        logging.info(f'Add product pid {cursor.lastrowid}: {new_product}')
+        self.revision += 1
+        if self._fuzzy_index is not None:
+            self._fuzzy_index.add(new_product.get_model().upper(), cursor.lastrowid)
+
+    def del_data(self, pid):
+        self._fuzzy_index = None
+        with self.conn:
+            cursor = self.conn.execute('DELETE FROM products WHERE pid = ?', (pid,))
+        if cursor.rowcount == 0:
+            logging.info(f"Product id not exist: {pid}")
+            raise ProductNotExist(f"Product id not exist: {pid}")
+        logging.info(f"Delete product id: {pid}")
+        self.revision += 1
+
+    def save(self, data_dir='data'):
+        self.conn.commit()
+        logging.info(f"Save data: {self.db_path.resolve()}")
+
+    def search_products(self, name=None, model=None, keyword='', sort='model'):
+        """Same result as DataLoader.search_products, filtered and ordered by the database."""
+        rows = self.conn.execute(
+            'SELECT pid, name, model, current, unit, raw_price, adjunct FROM products '
+            'WHERE (?1 IS NULL OR name = ?1) AND instr(full_model, ?2) > 0 '
+            'AND (instr(full_model, ?3) > 0 OR instr(name, ?3) > 0 OR instr(adjunct_key, ?3) > 0 '
+            'OR instr(pinyin, ?3) > 0) '
+            f"ORDER BY {'full_model, pid' if sort == 'model' else 'name, model, pid'}",
+            (name or None, model or '', keyword or ''))
+        return [(row[0], _to_product(row[1:])) for row in rows]
+
+    def fuzzy_search(self, keyword, k=20, name=None):
+        """Same result as DataLoader.fuzzy_search"""
+        if self._fuzzy_index is None:
+            self._fuzzy_index = BKTree()
+            self._fuzzy_index.rebuild([(row[1].upper(), row[0]) for row in
+                                       self.conn.execute('SELECT pid, full_model FROM products')])
+        result = []
+        for distance, model, pids in self._fuzzy_index.nearest(keyword.upper(), k):
+            for pid in sorted(pids):
+                p = self.get_product(pid)
+                if not name or name == p.get_name():
+                    result.append((pid, p))
+        return result[:k]
+
+    sorted = staticmethod(DataLoader.sorted)
+    search = staticmethod(DataLoader.search)
+
+    @staticmethod
+    def load(data_dir='data'):
+        """Open data/products.db, importing data/products.data the first time."""
+        dl = SqlDataLoader(data_dir)
+        if dl.conn.execute('SELECT COUNT(*) FROM products').fetchone()[0] == 0 and \
+                (Path(data_dir) / 'products.data').exists():
+            logging.info(f"Import products.data into: {dl.db_path.resolve()}")
+            for pid, product in DataLoader.load(data_dir).get_products_list():
+                try:
+                    dl.add_data(product, pid)
+                except ProductAlreadyExist:
+                    pass
+        logging.info(f"Load data from database: {dl.db_path.resolve()}")
+        return dl
+
+    def __str__(self):
+        result = ''
+        for i, v in self.get_products_list():
+            result += f'id {i}:{v}\n'
+        return result
+
+    def __getitem__(self, pid):
+        return self.get_product(pid)
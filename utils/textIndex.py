@@ -0,0 +1,127 @@
+from collections import Counter
+import math
+import pickle
+
+
+def _terms(text):
+    """Characters and character bigrams of lower cased text, whitespace excluded."""
+    text = text.lower()
+    terms = [c for c in text if not c.isspace()]
+    terms += [text[i:i + 2] for i in range(len(text) - 1) if not text[i].isspace() and not text[i + 1].isspace()]
+    return terms
+
+
+class TextIndex:
+    """
+    Ranked full-text index over the headers of a FileIndex (contracts, quotes).
+    Texts are indexed by characters and character bigrams, so Chinese words, partial tax numbers and phone
+    numbers are all found. Every word of a query must appear in the record; records are ranked by BM25 over the
+    query's bigrams, a field's weight multiplying its term counts (names and parties count more than comments).
+    """
+    version = 1
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, fields_func):
+        """
+        :param fields_func: header -> tuple of (weight, text)
+        """
+        self.fields_func = fields_func
+        self.postings = {}  # {term: {key: weighted term count}}
+        self.fields = {}  # {key: fields}
+        self.lengths = {}  # {key: weighted number of terms}
+        self.changed = False  # not persisted since the last change
+
+    def add(self, key, header):
+        self.remove(key)
+        fields = self.fields_func(header)
+        counts = Counter()
+        for weight, text in fields:
+            for term in _terms(text):
+                counts[term] += weight
+        for term, count in counts.items():
+            self.postings.setdefault(term, {})[key] = count
+        self.fields[key] = fields
+        self.lengths[key] = sum(counts.values())
+        self.changed = True
+
+    def remove(self, key):
+        fields = self.fields.pop(key, None)
+        if fields is None:
+            return
+        del self.lengths[key]
+        for term in {term for _, text in fields for term in _terms(text)}:
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(key, None)
+                if not posting:
+                    del self.postings[term]
+        self.changed = True
+
+    def sync(self, headers):
+        """
+        Index what changed since the index was persisted.
+        :param headers: {key: header}
+        """
+        for key in [key for key in self.fields if key not in headers]:
+            self.remove(key)
+        for key, header in headers.items():
+            if self.fields.get(key) != self.fields_func(header):
+                self.add(key, header)
+
+    def search(self, keyword, limit=None):
+        """
+        :param keyword: words separated by whitespace
+        :param limit: number of results, all if None
+        :return: [(key, score)], best first, newer keys first on equal scores
+        """
+        words = keyword.lower().split()
+        if not words or not self.fields:
+            return []
+        candidates = None
+        query = []
+        for word in words:
+            terms = set(_terms(word))
+            bigrams = [term for term in terms if len(term) == 2] or list(terms)
+            query += bigrams
+            postings = sorted((self.postings.get(term, {}) for term in bigrams), key=len)
+            found = set(postings[0])
+            for posting in postings[1:]:
+                found.intersection_update(posting)
+            candidates = found if candidates is None else candidates & found
+            if not candidates:
+                return []
+        if any(len(word) > 2 for word in words):
+            candidates = {key for key in candidates
+                          if all(any(word in text.lower() for _, text in self.fields[key]) for word in words)}
+        n = len(self.fields)
+        average = sum(self.lengths.values()) / n or 1
+        scores = dict.fromkeys(candidates, 0.0)
+        for term in query:
+            posting = self.postings[term]
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for key in candidates:
+                count = posting[key]
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[key] / average)
+                scores[key] += idf * count * (self.k1 + 1) / (count + norm)
+        ranked = sorted(scores.items(), key=lambda item: (item[1], item[0]), reverse=True)
+        return ranked if limit is None else ranked[:limit]
+
+    def dumps(self):
+        self.changed = False
+        return pickle.dumps((self.version, self.postings, self.fields, self.lengths))
+
+    @staticmethod
+    def load(path, fields_func):
+        """
+        :return: TextIndex persisted at path, an empty one if there is none or it is outdated or broken
+        """
+        index = TextIndex(fields_func)
+        try:
+            with open(path, 'rb') as f:
+                version, postings, fields, lengths = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return index
+        if version == TextIndex.version:
+            index.postings, index.fields, index.lengths = postings, fields, lengths
+        return index
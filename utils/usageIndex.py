@@ -0,0 +1,45 @@
+class UsageIndex:
+    """
+    Reverse index from product identity (Product.get_key()) to the lines of the records (contracts, quotes) whose
+    table contains the product, so finding where a product is used does not load any table.
+    """
+
+    def __init__(self):
+        self.uses = {}  # {product key: {record key: [line index]}}
+        self.records = {}  # {record key: (product key of every line)}
+
+    def set(self, key, product_keys):
+        """
+        :param key: cid or qid
+        :param product_keys: product key of every line of its table
+        """
+        product_keys = tuple(product_keys)
+        if self.records.get(key) == product_keys:
+            return
+        self.remove(key)
+        self.records[key] = product_keys
+        for line, product_key in enumerate(product_keys):
+            self.uses.setdefault(product_key, {}).setdefault(key, []).append(line)
+
+    def remove(self, key):
+        product_keys = self.records.pop(key, None)
+        if product_keys is None:
+            return
+        for product_key in set(product_keys):
+            records = self.uses[product_key]
+            del records[key]
+            if not records:
+                del self.uses[product_key]
+
+    def rebuild(self, items):
+        """:param items: [(record key, product keys)]"""
+        self.uses = {}
+        self.records = {}
+        for key, product_keys in items:
+            self.set(key, product_keys)
+
+    def where_used(self, product_key):
+        """
+        :return: [(record key, [line index])], newest record first
+        """
+        return sorted(((key, list(lines)) for key, lines in self.uses.get(product_key, {}).items()), reverse=True)